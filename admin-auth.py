@@ -1,13 +1,7 @@
 import mysql.connector
 import bcrypt
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='face_attendance'
-    )
+from db import get_db_connection
 
 def register_admin(username, password):
     hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
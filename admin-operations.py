@@ -1,17 +1,47 @@
 import cv2
-import pickle
-import mysql.connector
 import numpy as np
 
-face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+from config import GALLERY_BACKEND
+from db import get_db_connection
+from face_detect import local_detector
+from face_template import decode_template, encode_template
+from face_tracker import FaceTracker
+from gallery_store import sync_gallery
+from model_snapshot import update_snapshot
+from recognizer_shards import RecognizerShard, department_key
+from video_pipeline import VideoPipeline
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='face_attendance'
-    )
+
+def student_row(student_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, roll_number, department, face_image FROM students WHERE id = %s", (student_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row
+
+def student_info(student_id):
+    row = student_row(student_id)
+    return {'name': row[0], 'roll': row[1], 'dept': row[2]} if row else None
+
+def student_shard(department):
+    shard = RecognizerShard(department_key(department))
+    return shard, shard.current_fingerprint()
+
+def sync_models(student_id, shard, fingerprint_before, face=None, deleted=False):
+    # Applies this edit to the department's shared gallery and model snapshot so running
+    # services pick it up without rebuilding either.
+    try:
+        student_id = int(student_id)
+        fingerprint = shard.current_fingerprint()
+        if GALLERY_BACKEND == 'mmap':
+            sync_gallery(shard.gallery, student_id, fingerprint, face=face, deleted=deleted)
+        info = None if deleted else student_info(student_id)
+        update_snapshot(fingerprint_before, fingerprint, student_id, face=face, info=info, deleted=deleted,
+                        model_dir=shard.model_dir)
+    except Exception as e:
+        print(f" Could not update face gallery or model: {e}")
 
 def add_student():
     name = input("Enter name: ")
@@ -49,6 +79,13 @@ def update_student():
     roll = input("New roll number: ")
     dept = input("New department: ")
 
+    previous = student_row(student_id)
+    if previous is None:
+        print(" Student not found.")
+        return
+    old_shard, old_fingerprint = student_shard(previous[2])
+    new_shard, new_fingerprint = student_shard(dept)
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE students SET name = %s, roll_number = %s, department = %s WHERE id = %s",
@@ -56,21 +93,44 @@ def update_student():
     conn.commit()
     cursor.close()
     conn.close()
+
+    if old_shard.model_dir == new_shard.model_dir:
+        sync_models(student_id, new_shard, new_fingerprint)
+    else:
+        # Moved to another department: out of the old shard, into the new one.
+        sync_models(student_id, old_shard, old_fingerprint, deleted=True)
+        if previous[3] is not None:
+            sync_models(student_id, new_shard, new_fingerprint, face=decode_template(previous[3]))
+        else:
+            sync_models(student_id, new_shard, new_fingerprint)
     print(" Student updated successfully.")
 
 def delete_student():
     student_id = input("Enter the ID of the student to delete: ")
 
+    previous = student_row(student_id)
+    if previous is None:
+        print(" Student not found.")
+        return
+    shard, fingerprint = student_shard(previous[2])
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM students WHERE id = %s", (student_id,))
     conn.commit()
     cursor.close()
     conn.close()
+    sync_models(student_id, shard, fingerprint, deleted=True)
     print("🗑️ Student deleted successfully.")
 
 def update_student_face(student_id, face_array):
-    face_blob = pickle.dumps(face_array)  # Serialize numpy array
+    face_blob = encode_template(face_array)
+
+    previous = student_row(student_id)
+    if previous is None:
+        print(" Student not found.")
+        return
+    shard, fingerprint = student_shard(previous[2])
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -78,27 +138,28 @@ def update_student_face(student_id, face_array):
     conn.commit()
     cursor.close()
     conn.close()
+    sync_models(student_id, shard, fingerprint, face=face_array)
     print(f" Face image updated for student ID {student_id}")
 
+def detect_faces(gray):
+    return local_detector().detect(gray)
+
 def capture_face_image(student_id):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    tracker = FaceTracker(detect_faces)
+    pipeline = VideoPipeline(lambda frame: [box for _, box, _ in tracker.update(frame.gray, frame.index)])
+    if not pipeline.start():
         print(" Could not open webcam")
         return
 
     print("🎥 Position student's face and press SPACE to capture. ESC to cancel.")
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("⚠ Failed to capture frame")
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    for captured in pipeline.frames():
+        frame, gray = captured.image, captured.gray
+        faces = captured.result if captured.result is not None else ()
 
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
+        pipeline.draw_stats(frame)
         cv2.imshow("Capture Face - Press SPACE", frame)
 
         key = cv2.waitKey(1) & 0xFF
@@ -118,7 +179,9 @@ def capture_face_image(student_id):
             print("📸 Face captured and saved!")
             break
 
-    cap.release()
+    if pipeline.read_failed:
+        print("⚠ Failed to capture frame")
+    pipeline.stop()
     cv2.destroyAllWindows()
 
 def admin_menu():
@@ -0,0 +1,158 @@
+import math
+import threading
+import time
+from collections import deque
+
+from config import ADMISSION_KIOSK_MAX_QUEUED, ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT
+
+# Weight of the newest request in the moving average of service time.
+SERVICE_TIME_ALPHA = 0.1
+
+
+class Ticket:
+    def __init__(self, kiosk, deadline):
+        self.kiosk = kiosk
+        self.deadline = deadline
+        self.arrived = time.monotonic()
+        self.admitted_at = None
+        # Why the request was turned away: 'queue full', 'kiosk queue full', 'deadline passed' or 'queue timeout'.
+        self.rejected = None
+        self.retry_after = None
+
+
+class AdmissionController:
+    # Lets at most max_in_flight requests run at once. Others wait in a bounded queue, in a
+    # sub-queue per kiosk, and are admitted round-robin across kiosks so one busy kiosk cannot
+    # hold every free place. A request is turned away at once when the queue (or its kiosk's
+    # share) is full, and dropped when its client deadline passes or it has waited max_wait.
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 kiosk_max_queued=ADMISSION_KIOSK_MAX_QUEUED, max_wait=ADMISSION_MAX_WAIT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.kiosk_max_queued = kiosk_max_queued
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = {}
+        self.turns = deque()
+        self.queued = 0
+        self.service_time = 0.0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = {}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0
+
+    def retry_after(self):
+        # Seconds until a place is likely to free up for a request that would join the queue now.
+        service = self.service_time or 1.0
+        return max(1, int(math.ceil((self.queued + 1) * service / self.max_in_flight)))
+
+    def _reject(self, ticket, reason):
+        ticket.rejected = reason
+        ticket.retry_after = self.retry_after()
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return ticket
+
+    def _admit(self, ticket):
+        ticket.admitted_at = time.monotonic()
+        waited = ticket.admitted_at - ticket.arrived
+        self.in_flight += 1
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _dequeue(self, ticket):
+        queue = self.waiting[ticket.kiosk]
+        queue.remove(ticket)
+        self.queued -= 1
+        if not queue:
+            del self.waiting[ticket.kiosk]
+            self.turns.remove(ticket.kiosk)
+
+    def _dispatch(self):
+        # Hands free places to the head of each kiosk's queue in turn; expired heads are dropped.
+        now = time.time()
+        while self.turns and self.in_flight < self.max_in_flight:
+            kiosk = self.turns.popleft()
+            queue = self.waiting[kiosk]
+            ticket = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.turns.append(kiosk)
+            else:
+                del self.waiting[kiosk]
+            if ticket.deadline is not None and ticket.deadline <= now:
+                self._reject(ticket, 'deadline passed')
+            else:
+                self._admit(ticket)
+        self.cond.notify_all()
+
+    def enter(self, kiosk, deadline=None):
+        # Blocks until the request may run; check ticket.rejected before going on. deadline is the
+        # client's give-up time as a Unix timestamp.
+        ticket = Ticket(kiosk, deadline)
+        if not self.enabled:
+            return ticket
+        with self.cond:
+            if deadline is not None and deadline <= time.time():
+                return self._reject(ticket, 'deadline passed')
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self._admit(ticket)
+                return ticket
+            if self.queued >= self.max_queue:
+                return self._reject(ticket, 'queue full')
+            queue = self.waiting.get(kiosk)
+            if queue is not None and len(queue) >= self.kiosk_max_queued:
+                return self._reject(ticket, 'kiosk queue full')
+
+            if queue is None:
+                queue = self.waiting[kiosk] = deque()
+                self.turns.append(kiosk)
+            queue.append(ticket)
+            self.queued += 1
+
+            give_up = ticket.arrived + self.max_wait
+            if deadline is not None:
+                give_up = min(give_up, time.monotonic() + deadline - time.time())
+            while ticket.admitted_at is None and ticket.rejected is None:
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    self._dequeue(ticket)
+                    expired = deadline is not None and deadline <= time.time()
+                    return self._reject(ticket, 'deadline passed' if expired else 'queue timeout')
+                self.cond.wait(remaining)
+            return ticket
+
+    def leave(self, ticket):
+        if ticket.admitted_at is None:
+            return
+        with self.cond:
+            elapsed = time.monotonic() - ticket.admitted_at
+            self.service_time = elapsed if not self.completed else (
+                SERVICE_TIME_ALPHA * elapsed + (1 - SERVICE_TIME_ALPHA) * self.service_time)
+            self.in_flight -= 1
+            self.completed += 1
+            self._dispatch()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'enabled': self.enabled,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'kiosks_waiting': len(self.waiting),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'wait_avg_ms': 1000 * self.wait_total / self.admitted if self.admitted else 0.0,
+                'wait_max_ms': 1000 * self.wait_max,
+                'service_avg_ms': 1000 * self.service_time,
+                'retry_after': self.retry_after() if self.enabled else 0,
+            }
@@ -0,0 +1,219 @@
+import numpy as np
+
+from config import ANN_NLIST, ANN_NPROBE, ANN_PQ_M, ANN_RERANK, MATCH_BLOCK_BYTES
+from lbp import chi_square_distances, face_histograms
+
+PQ_CENTROIDS = 256
+TRAIN_SAMPLE = 4096
+KMEANS_ITERATIONS = 12
+ENCODE_CHUNK = 256
+# Incremental updates never move the partitions, so an index is due a retrain once it has grown
+# this many times past its size when trained, or its largest list this many times past its share then.
+REFIT_GROWTH = 4
+REFIT_IMBALANCE = 2
+
+
+def squared_l2(a, b):
+    # (len(a), len(b)) squared Euclidean distances via one matrix product.
+    return np.maximum((a * a).sum(1)[:, None] - 2 * a @ b.T + (b * b).sum(1)[None, :], 0)
+
+
+def kmeans(data, k, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = squared_l2(data, centroids).argmin(1)
+        for j in range(k):
+            members = data[assign == j]
+            # Re-seed an empty cluster from a random point rather than letting it die.
+            centroids[j] = members.mean(0) if len(members) else data[rng.integers(len(data))]
+    return centroids
+
+
+class IVFIndex:
+    # Inverted-file index over LBP histograms for 1:N identification on large galleries.
+    # Histograms are mapped to sqrt space (where Euclidean distance approximates chi-square),
+    # clustered into nlist partitions, and a query only scans the nprobe partitions nearest to
+    # it. With pq_m > 0 each vector is stored as pq_m one-byte product-quantization codes;
+    # the rerank best candidates are then rescored on their decoded histograms. Returned
+    # distances are chi-square, so the usual LBPH threshold still applies. Offers the same
+    # train/update/remove/predict/write/read interface as the other recognizers.
+
+    FILE_EXTENSION = '.npz'
+
+    def __init__(self, nlist=ANN_NLIST, nprobe=ANN_NPROBE, pq_m=ANN_PQ_M, rerank=ANN_RERANK):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.centroids = None
+        self.codebooks = None
+        self.list_ids = []
+        self.list_data = []
+        self.fitted_size = 0
+        self.fitted_largest = 0
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.list_ids)
+
+    def largest_list(self):
+        return max((len(ids) for ids in self.list_ids), default=0)
+
+    def needs_refit(self):
+        # True once updates have outgrown the partitions fixed at train time; the caller retrains.
+        size = len(self)
+        if self.centroids is None or not size:
+            return False
+        if size > REFIT_GROWTH * max(1, self.fitted_size):
+            return True
+        return (len(self.centroids) > 1 and
+                self.largest_list() / size > REFIT_IMBALANCE * self.fitted_largest / max(1, self.fitted_size))
+
+    # -- building -----------------------------------------------------------------------
+
+    def train(self, faces, labels):
+        faces = list(faces)
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(len(faces), min(len(faces), TRAIN_SAMPLE), replace=False))
+        self.fit(face_histograms([faces[i] for i in sample]), total=len(faces))
+        for start in range(0, len(faces), ENCODE_CHUNK):
+            self.add_histograms(face_histograms(faces[start:start + ENCODE_CHUNK]),
+                                labels[start:start + ENCODE_CHUNK])
+        self.fitted_size, self.fitted_largest = len(self), self.largest_list()
+
+    def fit(self, histograms, total=None):
+        vectors = np.sqrt(histograms)
+        total = total or len(vectors)
+        nlist = self.nlist or int(np.sqrt(total))
+        nlist = max(1, min(nlist, len(vectors)))
+        self.centroids = kmeans(vectors, nlist)
+        if self.pq_m:
+            if vectors.shape[1] % self.pq_m:
+                raise ValueError(f"pq_m={self.pq_m} must divide the histogram size {vectors.shape[1]}")
+            ks = min(PQ_CENTROIDS, len(vectors))
+            self.codebooks = np.stack([kmeans(part, ks, iterations=8)
+                                       for part in np.split(vectors, self.pq_m, axis=1)])
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        width = self.pq_m if self.pq_m else vectors.shape[1]
+        dtype = np.uint8 if self.pq_m else np.float32
+        self.list_data = [np.empty((0, width), dtype=dtype) for _ in range(nlist)]
+
+    def add_histograms(self, histograms, labels):
+        vectors = np.sqrt(histograms).astype(np.float32)
+        assign = squared_l2(vectors, self.centroids).argmin(1)
+        data = self.encode(vectors) if self.pq_m else vectors
+        for j in np.unique(assign):
+            members = assign == j
+            self.list_ids[j] = np.concatenate([self.list_ids[j], np.asarray(labels)[members]])
+            self.list_data[j] = np.concatenate([self.list_data[j], data[members]])
+
+    def update(self, faces, labels):
+        if self.centroids is None:
+            self.train(faces, labels)
+        else:
+            self.add_histograms(face_histograms(list(faces)), np.asarray(labels, dtype=np.int64).ravel())
+
+    def remove(self, label):
+        for j, ids in enumerate(self.list_ids):
+            keep = ids != label
+            if not keep.all():
+                self.list_ids[j], self.list_data[j] = ids[keep], self.list_data[j][keep]
+
+    # -- product quantization -----------------------------------------------------------
+
+    def encode(self, vectors):
+        parts = np.split(vectors, self.pq_m, axis=1)
+        return np.stack([squared_l2(part, book).argmin(1) for part, book in zip(parts, self.codebooks)],
+                        axis=1).astype(np.uint8)
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[i][codes[:, i]] for i in range(self.pq_m)], axis=1)
+
+    def adc_distances(self, vector, codes):
+        # Asymmetric distance: per-subspace lookup tables, summed over the codes.
+        tables = np.stack([squared_l2(part[None, :], book)[0]
+                           for part, book in zip(np.split(vector, self.pq_m), self.codebooks)])
+        return tables[np.arange(self.pq_m), codes].sum(1)
+
+    # -- search -------------------------------------------------------------------------
+
+    def exact_distances(self, histogram, parts, decode=False):
+        # Chi-square distances from one histogram to the vectors of parts in order (sqrt vectors,
+        # or PQ codes with decode), squared back a block at a time to cap temporary memory.
+        block = max(1, MATCH_BLOCK_BYTES // (len(histogram) * 4))
+        out = [np.empty(0, dtype=np.float32)]
+        for data in parts:
+            for start in range(0, len(data), block):
+                vectors = data[start:start + block]
+                vectors = self.decode(vectors) if decode else vectors
+                out.append(chi_square_distances(histogram, np.square(vectors))[0])
+        return np.concatenate(out)
+
+    def search(self, histograms, k=1, nprobe=None):
+        histograms = np.atleast_2d(histograms).astype(np.float32)
+        labels = np.full((len(histograms), k), -1, dtype=np.int64)
+        distances = np.full((len(histograms), k), np.inf, dtype=np.float32)
+        if self.centroids is None or not len(self):
+            return labels, distances
+
+        vectors = np.sqrt(histograms)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        coarse = squared_l2(vectors, self.centroids)
+        probed = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        for b, lists in enumerate(probed):
+            ids = np.concatenate([self.list_ids[j] for j in lists])
+            if not len(ids):
+                continue
+            if self.pq_m:
+                data = np.concatenate([self.list_data[j] for j in lists])
+                shortlist = min(len(ids), max(self.rerank, k))
+                approx = self.adc_distances(vectors[b], data)
+                keep = np.argpartition(approx, shortlist - 1)[:shortlist]
+                ids, exact = ids[keep], self.exact_distances(histograms[b], [data[keep]], decode=True)
+            else:
+                exact = self.exact_distances(histograms[b], [self.list_data[j] for j in lists])
+            top = min(k, len(ids))
+            best = np.argpartition(exact, top - 1)[:top]
+            best = best[np.argsort(exact[best])]
+            labels[b, :top], distances[b, :top] = ids[best], exact[best]
+        return labels, distances
+
+    def predict_batch(self, faces, k=1):
+        return self.search(face_histograms(list(faces)), k)
+
+    def predict(self, face):
+        labels, distances = self.predict_batch([face])
+        return int(labels[0, 0]), float(distances[0, 0])
+
+    # -- persistence --------------------------------------------------------------------
+
+    def write(self, path):
+        sizes = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                params=np.array([self.nlist, self.nprobe, self.pq_m, self.rerank], dtype=np.int64),
+                centroids=self.centroids,
+                codebooks=self.codebooks if self.codebooks is not None else np.empty(0, dtype=np.float32),
+                sizes=sizes,
+                fitted=np.array([self.fitted_size, self.fitted_largest], dtype=np.int64),
+                ids=np.concatenate(self.list_ids),
+                data=np.concatenate(self.list_data),
+            )
+
+    def read(self, path):
+        with np.load(path) as stored:
+            self.nlist, _, self.pq_m, self.rerank = (int(v) for v in stored['params'])
+            self.centroids = stored['centroids']
+            self.codebooks = stored['codebooks'] if self.pq_m else None
+            bounds = np.cumsum(stored['sizes'])[:-1]
+            self.list_ids = np.split(stored['ids'], bounds)
+            self.list_data = np.split(stored['data'], bounds)
+            if 'fitted' in stored:
+                self.fitted_size, self.fitted_largest = (int(v) for v in stored['fitted'])
+            else:
+                # Older snapshots: an automatic nlist was about sqrt of the size at train time.
+                self.fitted_size = min(len(self), len(self.centroids) ** 2)
+                self.fitted_largest = min(self.largest_list(), self.fitted_size)
@@ -1,37 +1,34 @@
 import cv2
-import pickle
 import mysql.connector
 
-face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+from db import get_db_connection
+from face_detect import local_detector
+from face_template import encode_template
+from face_tracker import FaceTracker
+from video_pipeline import VideoPipeline
+
+def detect_faces(gray):
+    return local_detector().detect(gray)
 
 def register_student(name, roll_number, department):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    tracker = FaceTracker(detect_faces)
+    pipeline = VideoPipeline(lambda frame: [box for _, box, _ in tracker.update(frame.gray, frame.index)])
+    if not pipeline.start():
         print(" Could not open webcam")
         return
 
     print(f" {name} from {department}, please look at the camera... Press 'q' to cancel.")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print(" Failed to capture frame")
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    for captured in pipeline.frames():
+        frame, gray = captured.image, captured.gray
+        faces = captured.result if captured.result is not None else ()
 
         for (x, y, w, h) in faces:
             face_crop = gray[y:y+h, x:x+w]
-            face_blob = pickle.dumps(face_crop)
+            face_blob = encode_template(face_crop)
 
             try:
-                conn = mysql.connector.connect(
-                    host='localhost',
-                    user='root',
-                    password='',
-                    database='face_attendance'
-                )
+                conn = get_db_connection()
                 cursor = conn.cursor()
 
                 cursor.execute(
@@ -46,19 +43,22 @@ def register_student(name, roll_number, department):
             except mysql.connector.Error as err:
                 print(f" Database error: {err}")
             finally:
-                cap.release()
+                pipeline.stop()
                 cv2.destroyAllWindows()
                 return
 
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
 
+        pipeline.draw_stats(frame)
         cv2.imshow('Register Face', frame)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             print(" Cancelled by user.")
             break
 
-    cap.release()
+    if pipeline.read_failed:
+        print(" Failed to capture frame")
+    pipeline.stop()
     cv2.destroyAllWindows()
     print(" Face not registered.")
 
@@ -0,0 +1,255 @@
+import argparse
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+
+import schema
+from attendance_writer import get_writer
+from config import CONFIDENCE_THRESHOLD, DAEMON_WORKERS, KIOSK_DEPARTMENT
+from db import get_db_connection
+from face_detect import local_detector
+from face_template import TEMPLATE_SIZE
+from face_tracker import FaceTracker
+from frame_gate import MotionGate, QualityGate
+from marked_today import marked_today
+from recognizer_shards import ShardedRecognizer
+from video_pipeline import Frame, RateMeter
+
+RECONNECT_DELAY = 5.0
+
+shards = ShardedRecognizer()
+mark_lock = threading.Lock()
+
+
+def parse_source(value):
+    # Device index, video file or stream URL.
+    return int(value) if value.isdigit() else value
+
+
+def detect_faces(gray):
+    return local_detector().detect(gray)
+
+
+def accepted(identity):
+    return identity[0] is not None and identity[2] is not None and identity[1] < CONFIDENCE_THRESHOLD
+
+
+class Camera:
+    def __init__(self, source, department, loop):
+        self.source = parse_source(source)
+        self.name = os.path.basename(source) if os.path.exists(source) else source
+        self.is_file = isinstance(self.source, str) and os.path.exists(self.source)
+        self.department = department
+        self.loop = loop
+        self.quality = QualityGate()
+        self.tracker = FaceTracker(detect_faces, self.recognize, accepts=accepted, motion=MotionGate())
+        self.captured = RateMeter()
+        self.processed = RateMeter()
+        # Scheduler state, guarded by the scheduler's lock.
+        self.latest = None
+        self.queued = False
+        self.busy = False
+        self.dropped = 0
+        self.recognized = 0
+        self.marked = 0
+        self.finished = False
+
+    def open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            return None, 0.0
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Files stand in for live cameras, so they are read at their own frame rate.
+        fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0.0
+        return cap, (1.0 / fps if fps and fps > 0 else 0.0)
+
+    def capture(self, scheduler, stopped):
+        cap, interval = None, 0.0
+        index = 0
+        next_at = time.monotonic()
+        while not stopped.is_set():
+            if cap is None:
+                cap, interval = self.open()
+                if cap is None:
+                    if self.is_file:
+                        print(f" [{self.name}] Could not open video file")
+                        break
+                    print(f" [{self.name}] Could not open source, retrying in {RECONNECT_DELAY:.0f}s")
+                    stopped.wait(RECONNECT_DELAY)
+                    continue
+
+            ret, image = cap.read()
+            if not ret:
+                if self.is_file and self.loop:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                if self.is_file:
+                    break
+                print(f" [{self.name}] Lost video, reconnecting in {RECONNECT_DELAY:.0f}s")
+                cap.release()
+                cap = None
+                stopped.wait(RECONNECT_DELAY)
+                continue
+
+            scheduler.post(self, Frame(index, image))
+            self.captured.tick()
+            index += 1
+            if interval:
+                next_at = max(next_at + interval, time.monotonic() - interval)
+                stopped.wait(max(0.0, next_at - time.monotonic()))
+
+        if cap is not None:
+            cap.release()
+        self.finished = True
+
+    def recognize(self, gray, box):
+        x, y, w, h = box
+        face_crop = cv2.resize(gray[y:y + h, x:x + w], TEMPLATE_SIZE)
+        if self.quality.problem(face_crop):
+            return None
+        results = shards.recognize([face_crop], self.department)
+        identity = results[0] if results else (None, None, None)
+        if accepted(identity):
+            self.recognized += 1
+            self.mark(identity[2])
+        return identity
+
+    def mark(self, info):
+        roll = info['roll']
+        writer = get_writer()
+        with mark_lock:
+            if roll in marked_today or writer.is_pending(roll):
+                return
+            writer.submit(roll, info['name'], info['dept'])
+            marked_today.add(roll)
+        self.marked += 1
+        print(f" [{self.name}] Attendance marked: {info['name']} ({roll}) - {info['dept']} "
+              f"at {datetime.now().strftime('%H:%M:%S')}")
+
+    def process(self, frame):
+        frame.gray = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
+        self.tracker.update(frame.gray, frame.index)
+        self.processed.tick()
+
+    def stats_text(self):
+        return (f"capture {self.captured.rate():5.1f} fps, processed {self.processed.rate():5.1f} fps, "
+                f"{self.dropped} dropped, {self.recognized} recognized, {self.marked} marked")
+
+
+class FairScheduler:
+    # Each camera holds only its newest frame and sits in the ready queue at most once, and
+    # never while a worker is busy with it. Workers therefore serve cameras round-robin, a
+    # fast camera cannot starve a slow one, each camera's frames are processed in order, and
+    # a frame that is replaced before a worker gets to it is dropped.
+
+    def __init__(self):
+        self.ready = deque()
+        self.cond = threading.Condition()
+
+    def post(self, camera, frame):
+        with self.cond:
+            if camera.latest is not None:
+                camera.dropped += 1
+            camera.latest = frame
+            if not camera.busy and not camera.queued:
+                camera.queued = True
+                self.ready.append(camera)
+                self.cond.notify()
+
+    def take(self, timeout):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.ready, timeout):
+                return None, None
+            camera = self.ready.popleft()
+            frame, camera.latest = camera.latest, None
+            camera.queued, camera.busy = False, True
+            return camera, frame
+
+    def done(self, camera):
+        with self.cond:
+            camera.busy = False
+            if camera.latest is not None and not camera.queued:
+                camera.queued = True
+                self.ready.append(camera)
+                self.cond.notify()
+
+
+def work(scheduler, stopped):
+    while not stopped.is_set():
+        camera, frame = scheduler.take(timeout=0.5)
+        if camera is None:
+            continue
+        try:
+            camera.process(frame)
+        except Exception as e:
+            print(f" [{camera.name}] Processing error: {e}")
+        finally:
+            scheduler.done(camera)
+
+
+def report(cameras):
+    for camera in cameras:
+        print(f" [{camera.name}] {camera.stats_text()}")
+
+
+def run(args):
+    conn = get_db_connection()
+    schema.migrate(conn)
+    conn.close()
+    get_writer()
+    marked_today.refresh()
+    if args.department:
+        shard = shards.shard(args.department)
+        with shard.lock:
+            shard.load()
+    else:
+        print(f" Loaded {shards.load_all()} recognizer shard(s).")
+
+    cameras = [Camera(source, args.department, args.loop) for source in args.sources]
+    scheduler = FairScheduler()
+    stopped = threading.Event()
+    threads = [threading.Thread(target=camera.capture, args=(scheduler, stopped), name=f'capture-{i}', daemon=True)
+               for i, camera in enumerate(cameras)]
+    threads += [threading.Thread(target=work, args=(scheduler, stopped), name=f'worker-{i}', daemon=True)
+                for i in range(max(1, args.workers))]
+    for thread in threads:
+        thread.start()
+    print(f" Watching {len(cameras)} source(s) with {args.workers} worker(s). Press Ctrl+C to stop.")
+
+    started = time.monotonic()
+    next_report = started + args.report_interval
+    try:
+        while not all(camera.finished for camera in cameras):
+            if args.duration and time.monotonic() - started >= args.duration:
+                break
+            time.sleep(0.2)
+            if time.monotonic() >= next_report:
+                report(cameras)
+                next_report += args.report_interval
+    except KeyboardInterrupt:
+        print("\n Stopping.")
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join(timeout=2)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"\n Summary after {elapsed:.0f}s:")
+        for camera in cameras:
+            print(f" [{camera.name}] {camera.captured.total / elapsed:.1f} fps captured, "
+                  f"{camera.processed.total / elapsed:.1f} fps processed, {camera.dropped} dropped, "
+                  f"{camera.marked} marked")
+        get_writer().stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless attendance marking from several cameras at once")
+    parser.add_argument('sources', nargs='+', help="device indices, video files or stream URLs")
+    parser.add_argument('--department', default=KIOSK_DEPARTMENT, help="only search this department's students")
+    parser.add_argument('--workers', type=int, default=DAEMON_WORKERS, help="detection/recognition threads")
+    parser.add_argument('--loop', action='store_true', help="restart video files at the end (testing stand-in)")
+    parser.add_argument('--report-interval', type=float, default=10, help="seconds between per-camera reports")
+    parser.add_argument('--duration', type=float, default=0, help="stop after this many seconds (0 = run until stopped)")
+    run(parser.parse_args())
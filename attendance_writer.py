@@ -0,0 +1,184 @@
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from config import ATTENDANCE_BATCH_SIZE, ATTENDANCE_FLUSH_INTERVAL, ATTENDANCE_SPOOL_PATH
+from db import get_db_connection
+
+MAX_BACKOFF = 30.0
+# A claim older than this belongs to a flush that died; its rows may be claimed again.
+CLAIM_TIMEOUT = 120.0
+
+
+class AttendanceWriter:
+    # Write-behind attendance log. submit() appends to a local SQLite (WAL) spool and returns at
+    # once; a background thread moves spooled rows to MySQL with multi-row INSERTs and deletes
+    # them from the spool only after the commit. Rows left behind by a crash are replayed on the
+    # next start, and the unique spool_ref makes a replayed batch a no-op. Several processes may
+    # share one spool: a flush claims the rows it is about to write, and is_pending and the
+    # backlog are read from the spool, so they stay right whichever process wrote a row.
+
+    def __init__(self, spool_path=ATTENDANCE_SPOOL_PATH, batch_size=ATTENDANCE_BATCH_SIZE,
+                 flush_interval=ATTENDANCE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._spool = sqlite3.connect(spool_path, check_same_thread=False, isolation_level=None)
+        self._spool.execute("PRAGMA journal_mode=WAL")
+        self._spool.execute("PRAGMA synchronous=FULL")
+        self._spool.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, ref TEXT NOT NULL UNIQUE, roll_number TEXT NOT NULL, "
+            "name TEXT, department TEXT, marked_at TEXT NOT NULL, claimed_by TEXT, claimed_at REAL)"
+        )
+        columns = {row[1] for row in self._spool.execute("PRAGMA table_info(pending)")}
+        if 'claimed_by' not in columns:
+            # Spools written before claims existed.
+            self._spool.execute("ALTER TABLE pending ADD COLUMN claimed_by TEXT")
+            self._spool.execute("ALTER TABLE pending ADD COLUMN claimed_at REAL")
+        self._spool.execute("CREATE INDEX IF NOT EXISTS pending_roll ON pending (roll_number, marked_at)")
+        self._token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._thread.start()
+            backlog = self.pending_count()
+            if backlog:
+                print(f"Replaying {backlog} spooled attendance record(s).")
+                self._wake.set()
+        return self
+
+    def submit(self, roll_number, name, department, marked_at=None):
+        return self.submit_many([(roll_number, name, department)], marked_at)[0]
+
+    def submit_many(self, records, marked_at=None):
+        marked_at = (marked_at or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(uuid.uuid4().hex, roll, name, dept, marked_at) for roll, name, dept in records]
+        with self._lock:
+            self._spool.execute("BEGIN IMMEDIATE")
+            try:
+                self._spool.executemany(
+                    "INSERT INTO pending (ref, roll_number, name, department, marked_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._spool.execute("COMMIT")
+            except Exception:
+                self._spool.execute("ROLLBACK")
+                raise
+            backlog = self._spool.execute("SELECT COUNT(*) FROM pending WHERE claimed_by IS NULL").fetchone()[0]
+        if backlog >= self.batch_size:
+            self._wake.set()
+        return [row[0] for row in rows]
+
+    def is_pending(self, roll_number, day=None):
+        day = (day or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        with self._lock:
+            return self._spool.execute(
+                "SELECT 1 FROM pending WHERE roll_number = ? AND marked_at >= ? AND marked_at < ? LIMIT 1",
+                (roll_number, day.strftime('%Y-%m-%d'), (day + timedelta(days=1)).strftime('%Y-%m-%d'))
+            ).fetchone() is not None
+
+    def pending_count(self):
+        with self._lock:
+            return self._spool.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def _claim(self):
+        # Marks the next batch of unclaimed (or abandoned) rows as this writer's and returns them.
+        now = time.time()
+        with self._lock:
+            self._spool.execute("BEGIN IMMEDIATE")
+            try:
+                batch = self._spool.execute(
+                    "SELECT id, ref, roll_number, name, department, marked_at FROM pending "
+                    "WHERE claimed_by IS NULL OR claimed_at < ? ORDER BY id LIMIT ?",
+                    (now - CLAIM_TIMEOUT, self.batch_size)
+                ).fetchall()
+                self._spool.executemany("UPDATE pending SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                                        [(self._token, now, row[0]) for row in batch])
+                self._spool.execute("COMMIT")
+            except Exception:
+                self._spool.execute("ROLLBACK")
+                raise
+        return batch
+
+    def flush(self):
+        # Drains the spool; returns the number of rows written. Safe to call from any thread.
+        total = 0
+        with self._flush_lock:
+            while True:
+                batch = self._claim()
+                if not batch:
+                    return total
+
+                try:
+                    conn = get_db_connection()
+                    try:
+                        cursor = conn.cursor()
+                        values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+                        cursor.execute(
+                            "INSERT IGNORE INTO attendance_log (roll_number, name, department, timestamp, spool_ref) "
+                            f"VALUES {values}",
+                            [value for row in batch for value in (row[2], row[3], row[4], row[5], row[1])]
+                        )
+                        conn.commit()
+                        cursor.close()
+                    finally:
+                        conn.close()
+                except Exception:
+                    # Hand the rows back so the next flush, here or in another process, retries them.
+                    with self._lock:
+                        self._spool.executemany(
+                            "UPDATE pending SET claimed_by = NULL WHERE id = ? AND claimed_by = ?",
+                            [(row[0], self._token) for row in batch])
+                    raise
+
+                with self._lock:
+                    self._spool.executemany("DELETE FROM pending WHERE id = ?", [(row[0],) for row in batch])
+                total += len(batch)
+                self.written += len(batch)
+
+    def _run(self):
+        backoff = self.flush_interval
+        while not self._stop.is_set():
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                self.flush()
+                backoff = self.flush_interval
+            except Exception as e:
+                self.failures += 1
+                backoff = min(max(backoff * 2, 1.0), MAX_BACKOFF)
+                print(f"Attendance flush failed, retrying in {backoff:.0f}s: {e}")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Attendance records left in spool for next start: {e}")
+
+
+writer = None
+writer_lock = threading.Lock()
+
+
+def get_writer():
+    global writer
+    if writer is None:
+        with writer_lock:
+            if writer is None:
+                writer = AttendanceWriter().start()
+    return writer
@@ -0,0 +1,102 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from ann_index import IVFIndex
+from face_template import TEMPLATE_SIZE, decode_template
+from lbp import face_histograms
+from lbp_matcher import LBPMatcher
+
+def synthetic_faces(count, seed=0):
+    # Smooth random textures: not faces, but they give LBP histograms with realistic spread.
+    rng = np.random.default_rng(seed)
+    faces = []
+    for _ in range(count):
+        coarse = rng.integers(0, 256, (25, 25)).astype(np.uint8)
+        face = cv2.resize(coarse, TEMPLATE_SIZE, interpolation=cv2.INTER_CUBIC)
+        faces.append(cv2.add(face, rng.integers(0, 12, face.shape, dtype=np.uint8)))
+    return faces, list(range(1, count + 1))
+
+def database_faces(limit):
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, face_image FROM students WHERE face_image IS NOT NULL ORDER BY id LIMIT %s", (limit,))
+    faces, labels = [], []
+    for student_id, face_blob in cursor:
+        try:
+            faces.append(decode_template(face_blob))
+            labels.append(student_id)
+        except ValueError:
+            continue
+    cursor.close()
+    conn.close()
+    return faces, labels
+
+def make_probes(faces, count, seed=1):
+    # Re-captures of enrolled faces: small shift, brightness change and sensor noise.
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(faces), min(count, len(faces)), replace=False)
+    probes = []
+    for i in picks:
+        probe = np.roll(faces[i], rng.integers(-3, 4, 2), axis=(0, 1)).astype(np.int16)
+        probe += rng.integers(-15, 16) + rng.integers(-6, 7, probe.shape)
+        probes.append(np.clip(probe, 0, 255).astype(np.uint8))
+    return probes
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run(args):
+    if args.from_db:
+        faces, labels = database_faces(args.gallery)
+    else:
+        faces, labels = synthetic_faces(args.gallery)
+    if not faces:
+        print(" No faces to benchmark.")
+        return
+    probes = make_probes(faces, args.queries)
+    print(f" Gallery: {len(faces)} templates, {len(probes)} queries, k={args.k}")
+
+    gallery, build_hist = timed(face_histograms, faces)
+    queries = face_histograms(probes)
+    print(f" Histograms: {build_hist:.1f}s")
+
+    exact = LBPMatcher()
+    exact.histograms, exact.labels = gallery, np.asarray(labels, dtype=np.int64)
+    (exact_labels, _), exact_time = timed(exact.match, queries, args.k)
+
+    index = IVFIndex(nlist=args.nlist, pq_m=args.pq_m, rerank=args.rerank)
+    sample = gallery[np.random.default_rng(0).choice(len(gallery), min(len(gallery), 4096), replace=False)]
+    _, train_time = timed(index.fit, sample, len(gallery))
+    _, add_time = timed(index.add_histograms, gallery, labels)
+    print(f" IVF: {len(index.centroids)} lists, pq_m={args.pq_m}, train {train_time:.1f}s, add {add_time:.1f}s")
+
+    per_query = 1000 * exact_time / len(queries)
+    print(f"\n {'nprobe':>6} {'recall@k':>9} {'top-1':>7} {'ms/query':>9} {'speedup':>8}")
+    print(f" {'exact':>6} {1.0:>9.3f} {1.0:>7.3f} {per_query:>9.2f} {1.0:>7.1f}x")
+    for nprobe in args.nprobe:
+        if nprobe > len(index.centroids):
+            break
+        (approx_labels, _), approx_time = timed(index.search, queries, args.k, nprobe)
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx_labels, exact_labels)])
+        top1 = np.mean(approx_labels[:, 0] == exact_labels[:, 0])
+        approx_ms = 1000 * approx_time / len(queries)
+        print(f" {nprobe:>6} {recall:>9.3f} {top1:>7.3f} {approx_ms:>9.2f} {per_query / approx_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and latency of the IVF index against exact LBP search")
+    parser.add_argument('--gallery', type=int, default=5000, help="number of gallery templates")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--nlist', type=int, default=0, help="partitions (0 = sqrt of gallery size)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--pq-m', type=int, default=0, help="product-quantization subspaces (0 = off)")
+    parser.add_argument('--rerank', type=int, default=64)
+    parser.add_argument('--from-db', action='store_true', help="use enrolled templates instead of synthetic ones")
+    run(parser.parse_args())
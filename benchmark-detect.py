@@ -0,0 +1,64 @@
+import argparse
+import time
+
+import cv2
+
+from face_detect import FaceDetector, count_hits, load_samples
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run(args):
+    images, labels = load_samples(args.images)
+    if not images:
+        print(f" No images found in {args.images}")
+        return
+
+    cascade = cv2.CascadeClassifier(args.cascade)
+    detector = FaceDetector(cascade, max_side=args.max_side, roi=args.roi, distance_min=args.distance_min,
+                            distance_max=args.distance_max, hfov=args.hfov)
+
+    baseline_time = front_time = 0.0
+    expected_total = baseline_hits = front_hits = front_total = 0
+    for name, gray in images:
+        for _ in range(args.repeat):
+            baseline, elapsed = timed(cascade.detectMultiScale, gray, 1.1, 5)
+            baseline_time += elapsed
+            found, elapsed = timed(detector.detect, gray)
+            front_time += elapsed
+
+        # Without labels.csv the full-resolution detections are the reference.
+        baseline = [tuple(int(v) for v in box) for box in baseline]
+        expected = labels.get(name, []) if labels is not None else baseline
+        expected_total += len(expected)
+        baseline_hits += count_hits(baseline, expected, args.iou)
+        front_hits += count_hits(found, expected, args.iou)
+        front_total += len(found)
+
+    runs = len(images) * args.repeat
+    reference = "labels.csv" if labels is not None else "full-resolution detections"
+    print(f" {len(images)} image(s), {expected_total} face(s) in {reference}, IoU >= {args.iou}")
+    print(f"\n {'':<12} {'ms/image':>9} {'recall':>7} {'boxes':>6}")
+    for title, elapsed, hits, total in (
+            ('full image', baseline_time, baseline_hits, None),
+            ('front-end', front_time, front_hits, front_total)):
+        recall = hits / expected_total if expected_total else 1.0
+        boxes = total if total is not None else '-'
+        print(f" {title:<12} {1000 * elapsed / runs:>9.1f} {recall:>7.3f} {boxes:>6}")
+    print(f"\n Speedup: {baseline_time / front_time:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and recall of the detection front-end against full-image detection")
+    parser.add_argument('images', help="folder of sample images, optionally with labels.csv (file,x,y,w,h)")
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml')
+    parser.add_argument('--max-side', type=int, default=640)
+    parser.add_argument('--roi', default='', help="x,y,w,h as fractions of the image")
+    parser.add_argument('--distance-min', type=float, default=0.0,
+                        help="closest face distance in metres (0 = no largest face)")
+    parser.add_argument('--distance-max', type=float, default=3.0, help="farthest face distance in metres")
+    parser.add_argument('--hfov', type=float, default=65, help="camera horizontal field of view in degrees")
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,123 @@
+import os
+
+DB_CONFIG = {
+    'host': os.environ.get('FACE_DB_HOST', 'localhost'),
+    'port': int(os.environ.get('FACE_DB_PORT', '3306')),
+    'user': os.environ.get('FACE_DB_USER', 'root'),
+    'password': os.environ.get('FACE_DB_PASSWORD', ''),
+    'database': os.environ.get('FACE_DB_NAME', 'face_attendance'),
+    'charset': 'utf8mb4',
+    'collation': 'utf8mb4_unicode_ci'
+}
+DB_POOL_SIZE = int(os.environ.get('FACE_DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('FACE_DB_POOL_TIMEOUT', '10'))
+# Connections older than this are reopened; idle ones are pinged before reuse.
+DB_POOL_RECYCLE = float(os.environ.get('FACE_DB_POOL_RECYCLE', '3600'))
+DB_POOL_PING_AFTER = float(os.environ.get('FACE_DB_POOL_PING_AFTER', '30'))
+
+MODEL_DIR = os.environ.get('FACE_MODEL_DIR', 'models')
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('FACE_SNAPSHOT_CHECK_INTERVAL', '5'))
+
+# One recognizer, snapshot and gallery per department; set to 0 for a single model over all students.
+SHARD_BY_DEPARTMENT = os.environ.get('FACE_SHARD_BY_DEPARTMENT', '1') != '0'
+# Threads used to search every department shard when a request does not name one.
+SHARD_SEARCH_THREADS = int(os.environ.get('FACE_SHARD_SEARCH_THREADS', '4'))
+# Department served by this kiosk; recognition requests without a department search only this shard.
+KIOSK_DEPARTMENT = os.environ.get('FACE_DEPARTMENT') or None
+# A match is accepted when its LBPH distance ("confidence") is below this; lower is closer.
+CONFIDENCE_THRESHOLD = float(os.environ.get('FACE_CONFIDENCE_THRESHOLD', '70'))
+
+# 'db' loads templates straight from MySQL; 'mmap' shares a memory-mapped gallery file between processes.
+GALLERY_BACKEND = os.environ.get('FACE_GALLERY_BACKEND', 'db')
+GALLERY_DIR = os.environ.get('FACE_GALLERY_DIR', 'gallery')
+
+# Decode uploads at 1/N resolution (1, 2, 4 or 8) for detection; crops come from full resolution when needed.
+DECODE_REDUCTION = int(os.environ.get('FACE_DECODE_REDUCTION', '1'))
+# Uploaded images are detected on a copy whose longer side is at most this many pixels (0 = never downscale).
+DETECT_MAX_SIDE = int(os.environ.get('FACE_DETECT_MAX_SIDE', '640'))
+# Expected distance between face and camera in metres, converted to min/max face sizes using the
+# camera's horizontal field of view (degrees) and an average face width of FACE_WIDTH_M metres.
+# FACE_DISTANCE_MIN=0 (the default) sets no largest face, so close-up phone photos are still found.
+FACE_DISTANCE_MIN = float(os.environ.get('FACE_DISTANCE_MIN', '0'))
+FACE_DISTANCE_MAX = float(os.environ.get('FACE_DISTANCE_MAX', '3.0'))
+CAMERA_HFOV = float(os.environ.get('FACE_CAMERA_HFOV', '65'))
+FACE_WIDTH_M = float(os.environ.get('FACE_WIDTH_M', '0.16'))
+# Optional search region 'x,y,w,h' as fractions of the image, e.g. '0.2,0,0.6,1'.
+DETECT_ROI = os.environ.get('FACE_DETECT_ROI', '')
+# Group photos (/api/mark_attendance_group) are searched at this longer side (0 = full size) and for faces out
+# to this distance, whatever the kiosk settings or detection profile say, so the back rows are still found.
+GROUP_DETECT_MAX_SIDE = int(os.environ.get('FACE_GROUP_DETECT_MAX_SIDE', '0'))
+GROUP_DISTANCE_MAX = float(os.environ.get('FACE_GROUP_DISTANCE_MAX', '10.0'))
+# Named detection settings written by tune-detection.py; every capture and upload path loads
+# FACE_DETECTION_PROFILE at startup when it is set.
+DETECTION_PROFILES_PATH = os.environ.get('FACE_DETECTION_PROFILES', 'detection_profiles.json')
+DETECTION_PROFILE = os.environ.get('FACE_DETECTION_PROFILE', '')
+
+# Recognized attendance is spooled to a local SQLite file and written to MySQL in batches.
+ATTENDANCE_SPOOL_PATH = os.environ.get('FACE_ATTENDANCE_SPOOL', 'attendance_spool.db')
+ATTENDANCE_BATCH_SIZE = int(os.environ.get('FACE_ATTENDANCE_BATCH_SIZE', '200'))
+ATTENDANCE_FLUSH_INTERVAL = float(os.environ.get('FACE_ATTENDANCE_FLUSH_INTERVAL', '0.5'))
+
+# 'lbph' uses cv2.face.LBPHFaceRecognizer, 'numpy' the vectorized matcher in lbp_matcher.py and
+# 'ivf' the approximate nearest-neighbour index in ann_index.py.
+RECOGNIZER_BACKEND = os.environ.get('FACE_RECOGNIZER_BACKEND', 'lbph')
+# Settings for the 'ivf' backend (ann_index.py). ANN_NLIST=0 picks about sqrt(N) partitions;
+# ANN_NPROBE trades recall for latency; ANN_PQ_M > 0 stores product-quantized codes instead of vectors.
+ANN_NLIST = int(os.environ.get('FACE_ANN_NLIST', '0'))
+ANN_NPROBE = int(os.environ.get('FACE_ANN_NPROBE', '8'))
+ANN_PQ_M = int(os.environ.get('FACE_ANN_PQ_M', '0'))
+ANN_RERANK = int(os.environ.get('FACE_ANN_RERANK', '64'))
+# Upper bound on the temporary array the numpy matcher builds per gallery block.
+MATCH_BLOCK_BYTES = int(os.environ.get('FACE_MATCH_BLOCK_BYTES', str(32 * 1024 * 1024)))
+
+# Per-student LBP histograms kept for 1:1 verification (about 64 KB each).
+VERIFY_CACHE_SIZE = int(os.environ.get('FACE_VERIFY_CACHE_SIZE', '1024'))
+
+# Recognition requests arriving together are decoded and detected on BATCH_WORKERS threads and
+# scored in one call. A batch waits at most BATCH_MAX_WAIT_MS for up to BATCH_MAX_SIZE requests;
+# 0 turns batching off.
+BATCH_MAX_SIZE = int(os.environ.get('FACE_BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('FACE_BATCH_MAX_WAIT_MS', '5'))
+BATCH_WORKERS = int(os.environ.get('FACE_BATCH_WORKERS', str(os.cpu_count() or 2)))
+# With RECOGNITION_PROCESSES > 0, batches are detected and scored in that many worker processes, each
+# with its own recognizer, instead of in main.py's process. Encoded images are handed over in shared-memory
+# slots of RECOGNITION_SLOT_MB; a worker busy with one job for RECOGNITION_TIMEOUT seconds is restarted.
+RECOGNITION_PROCESSES = int(os.environ.get('FACE_RECOGNITION_PROCESSES', '0'))
+RECOGNITION_SLOT_MB = float(os.environ.get('FACE_RECOGNITION_SLOT_MB', '2'))
+RECOGNITION_TIMEOUT = float(os.environ.get('FACE_RECOGNITION_TIMEOUT', '10'))
+# Recognition endpoints run at most ADMISSION_MAX_IN_FLIGHT requests at once (0 = no limit). Up to
+# ADMISSION_MAX_QUEUE more wait, at most ADMISSION_KIOSK_MAX_QUEUED per kiosk and ADMISSION_MAX_WAIT
+# seconds each; anything beyond that gets 503 with Retry-After.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('FACE_ADMISSION_MAX_IN_FLIGHT', '16'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('FACE_ADMISSION_MAX_QUEUE', '64'))
+ADMISSION_KIOSK_MAX_QUEUED = int(os.environ.get('FACE_ADMISSION_KIOSK_MAX_QUEUED', '8'))
+ADMISSION_MAX_WAIT = float(os.environ.get('FACE_ADMISSION_MAX_WAIT', '5'))
+# Per-stage latency histograms and counters served on /metrics; FACE_METRICS=0 turns them off.
+METRICS_ENABLED = os.environ.get('FACE_METRICS', '1') != '0'
+# One JSON line of stage timings per request: '-' for stdout, a file path to append to, '' for none.
+METRICS_LOG = os.environ.get('FACE_METRICS_LOG', '')
+
+# Webcam loops: detection/recognition worker threads and the depth of the drop-oldest frame queues.
+PIPELINE_WORKERS = int(os.environ.get('FACE_PIPELINE_WORKERS', '2'))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('FACE_PIPELINE_QUEUE_SIZE', '2'))
+# Detection/recognition threads shared by all cameras in attendance-daemon.py.
+DAEMON_WORKERS = int(os.environ.get('FACE_DAEMON_WORKERS', str(os.cpu_count() or 2)))
+# Full-frame face detection runs every N frames (or when a track is lost); faces are followed by
+# template matching in between and recognized once per track.
+DETECT_EVERY = int(os.environ.get('FACE_DETECT_EVERY', '5'))
+TRACK_MATCH_THRESHOLD = float(os.environ.get('FACE_TRACK_MATCH_THRESHOLD', '0.6'))
+# Search area around a face's last box, as a fraction of the box size.
+TRACK_SEARCH_MARGIN = float(os.environ.get('FACE_TRACK_SEARCH_MARGIN', '0.5'))
+TRACK_MAX_MISSES = int(os.environ.get('FACE_TRACK_MAX_MISSES', '2'))
+# Frames before a track that was not recognized is tried again.
+RECOGNIZE_RETRY = int(os.environ.get('FACE_RECOGNIZE_RETRY', '15'))
+# Detection is skipped while less than MOTION_MIN_CHANGE of the (80x60) frame changed by more than
+# MOTION_THRESHOLD grey levels, for at most MOTION_MAX_SKIP frames in a row.
+MOTION_THRESHOLD = int(os.environ.get('FACE_MOTION_THRESHOLD', '15'))
+MOTION_MIN_CHANGE = float(os.environ.get('FACE_MOTION_MIN_CHANGE', '0.005'))
+MOTION_MAX_SKIP = int(os.environ.get('FACE_MOTION_MAX_SKIP', '30'))
+# Face crops below this sharpness (variance of the Laplacian at template size) or outside this
+# mean brightness range are not recognized or enrolled.
+QUALITY_MIN_SHARPNESS = float(os.environ.get('FACE_QUALITY_MIN_SHARPNESS', '50'))
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get('FACE_QUALITY_MIN_BRIGHTNESS', '40'))
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get('FACE_QUALITY_MAX_BRIGHTNESS', '220'))
@@ -0,0 +1,219 @@
+import queue
+import threading
+import time
+
+import mysql.connector
+
+import metrics
+from config import DB_CONFIG, DB_POOL_PING_AFTER, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT
+
+
+def timed_call(fn, *args, **kwargs):
+    # Adds the call's time to the current request's 'db' stage and counts failures.
+    with metrics.stage('db'):
+        try:
+            return fn(*args, **kwargs)
+        except mysql.connector.Error:
+            metrics.inc('face_db_errors_total')
+            raise
+
+
+class TimedCursor:
+    # Proxies a cursor so statement execution and fetching count towards the 'db' stage.
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        # Streams rows (the gallery build reads every template this way); not timed per row.
+        return iter(self._cursor)
+
+    def execute(self, *args, **kwargs):
+        return timed_call(self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return timed_call(self._cursor.executemany, *args, **kwargs)
+
+    def fetchone(self):
+        return timed_call(self._cursor.fetchone)
+
+    def fetchall(self):
+        return timed_call(self._cursor.fetchall)
+
+
+class PooledConnection:
+    # Proxies a MySQL connection; close() hands it back to the pool instead of disconnecting.
+
+    def __init__(self, pool, cnx, created):
+        self._pool = pool
+        self._cnx = cnx
+        self._created = created
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._cnx.cursor(*args, **kwargs))
+
+    def commit(self):
+        return timed_call(self._cnx.commit)
+
+    def close(self):
+        if self._cnx is not None:
+            cnx, self._cnx = self._cnx, None
+            self._pool._release(cnx, self._created)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # Routes that bail out on an exception never reach close(); don't leak their slot.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+
+    def __init__(self, config=DB_CONFIG, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 recycle=DB_POOL_RECYCLE, ping_after=DB_POOL_PING_AFTER):
+        self.config = dict(config, consume_results=True)
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._opened = 0
+        self._recycled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def get_connection(self):
+        with metrics.stage('db_connect'):
+            return self._get_connection()
+
+    def _get_connection(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            metrics.inc('face_db_errors_total')
+            raise mysql.connector.errors.PoolError(
+                f"No database connection available within {self.timeout:.1f}s (pool size {self.size})")
+        waited = time.monotonic() - start
+
+        try:
+            cnx, created = self._checkout()
+        except Exception:
+            self._slots.release()
+            metrics.inc('face_db_errors_total')
+            raise
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, cnx, created)
+
+    def _checkout(self):
+        now = time.monotonic()
+        while True:
+            try:
+                cnx, created, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if now - created > self.recycle or (now - last_used > self.ping_after and not self._healthy(cnx)):
+                self._discard(cnx)
+                with self._lock:
+                    self._recycled += 1
+                continue
+            return cnx, created
+
+        cnx = mysql.connector.connect(**self.config)
+        with self._lock:
+            self._opened += 1
+        return cnx, now
+
+    def _healthy(self, cnx):
+        try:
+            cnx.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    def _release(self, cnx, created):
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+            self._idle.put((cnx, created, time.monotonic()))
+        except Exception:
+            self._discard(cnx)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'peak_in_use': self._peak_in_use,
+                'utilization': self._in_use / self.size,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'opened': self._opened,
+                'recycled': self._recycled,
+                'wait_avg_ms': 1000 * self._wait_total / self._checkouts if self._checkouts else 0.0,
+                'wait_max_ms': 1000 * self._wait_max,
+            }
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = ConnectionPool()
+    return pool
+
+
+def get_db_connection():
+    return get_pool().get_connection()
+
+
+def connect_server():
+    # Unpooled connection without a default database, for creating it.
+    config = dict(DB_CONFIG)
+    config.pop('database', None)
+    return mysql.connector.connect(**config)
+
+
+def pool_stats():
+    return get_pool().stats()
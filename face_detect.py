@@ -0,0 +1,192 @@
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+import cv2
+
+from config import (CAMERA_HFOV, DETECT_MAX_SIDE, DETECT_ROI, DETECTION_PROFILE, DETECTION_PROFILES_PATH,
+                    FACE_DISTANCE_MAX, FACE_DISTANCE_MIN, FACE_WIDTH_M, GROUP_DETECT_MAX_SIDE, GROUP_DISTANCE_MAX)
+from face_tracker import iou
+
+CASCADE_PATH = 'haarcascade_frontalface_default.xml'
+# Smallest face the default Haar cascade can find (its training window).
+CASCADE_WINDOW = 24
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# FaceDetector settings a detection profile may set.
+PROFILE_KEYS = ('scale_factor', 'min_neighbors', 'min_size', 'max_side', 'roi', 'distance_min', 'distance_max', 'hfov')
+# Settings for group photos, applied over the profile: the whole image, and faces further away than a kiosk's.
+GROUP_SETTINGS = {'max_side': GROUP_DETECT_MAX_SIDE, 'distance_max': GROUP_DISTANCE_MAX}
+
+_local = threading.local()
+_profile = None
+
+
+def parse_roi(value):
+    # 'x,y,w,h' as fractions of the frame, e.g. '0.2,0,0.6,1' for the middle 60% of the width.
+    if not value:
+        return None
+    x, y, w, h = (float(v) for v in value.split(','))
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 - x and 0 < h <= 1 - y):
+        raise ValueError(f"Invalid detection ROI '{value}'")
+    return x, y, w, h
+
+
+def face_size_range(image_width, hfov=CAMERA_HFOV, distance_min=FACE_DISTANCE_MIN, distance_max=FACE_DISTANCE_MAX,
+                    face_width=FACE_WIDTH_M):
+    # Expected face width in pixels at the far and near ends of the working distance, from a
+    # pinhole camera with horizontal field of view hfov (degrees). distance_min <= 0 means no
+    # largest face (None).
+    focal = image_width / (2 * math.tan(math.radians(hfov) / 2))
+    return focal * face_width / distance_max, focal * face_width / distance_min if distance_min > 0 else None
+
+
+class FaceDetector:
+    # Haar detection front-end: searches only the region of interest, on a copy downscaled so
+    # the longer side is at most max_side (but never so far that the smallest expected face
+    # drops below the cascade window), with minSize from the working distance, and maxSize too
+    # when distance_min is set. Boxes are returned in the coordinates of the image passed in.
+
+    def __init__(self, cascade, scale_factor=1.1, min_neighbors=5, min_size=0, max_side=DETECT_MAX_SIDE,
+                 roi=DETECT_ROI, distance_min=FACE_DISTANCE_MIN, distance_max=FACE_DISTANCE_MAX, hfov=CAMERA_HFOV):
+        self.cascade = cascade
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.max_side = max_side
+        self.roi = parse_roi(roi) if isinstance(roi, str) else roi
+        self.distance_min = distance_min
+        self.distance_max = distance_max
+        self.hfov = hfov
+
+    def region(self, gray):
+        height, width = gray.shape[:2]
+        if self.roi is None:
+            return 0, 0, width, height
+        x, y, w, h = self.roi
+        return int(x * width), int(y * height), max(1, int(w * width)), max(1, int(h * height))
+
+    def detect(self, gray):
+        rx, ry, rw, rh = self.region(gray)
+        area = gray[ry:ry + rh, rx:rx + rw]
+
+        # Face sizes depend on the whole frame's field of view, not on the ROI.
+        min_face, max_face = face_size_range(gray.shape[1], self.hfov, self.distance_min, self.distance_max)
+        min_face = max(min_face, self.min_size)
+        scale = 1.0
+        if self.max_side and max(area.shape) > self.max_side:
+            scale = self.max_side / float(max(area.shape))
+        scale = min(1.0, max(scale, CASCADE_WINDOW / min_face))
+        if scale < 1.0:
+            area = cv2.resize(area, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        min_size = max(CASCADE_WINDOW, int(min_face * scale))
+        # (0, 0) leaves the largest face unbounded.
+        max_size = max(min_size + 1, int(math.ceil(max_face * scale))) if max_face is not None else 0
+        faces = self.cascade.detectMultiScale(area, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors,
+                                              minSize=(min_size, min_size), maxSize=(max_size, max_size))
+        return [(int(x / scale) + rx, int(y / scale) + ry, int(w / scale), int(h / scale))
+                for (x, y, w, h) in faces]
+
+
+def load_profiles(path=DETECTION_PROFILES_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f).get('profiles', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profile(name, settings, results, path=DETECTION_PROFILES_PATH):
+    data = {'profiles': load_profiles(path)}
+    data['profiles'][name] = dict(settings, tuned=dict(results, created=time.time()))
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def detection_profile(name=DETECTION_PROFILE):
+    # Settings of the configured profile, read once per process; {} keeps each caller's defaults.
+    global _profile
+    if _profile is None:
+        profile = load_profiles().get(name) if name else None
+        if name and profile is None:
+            print(f"Detection profile '{name}' not found in {DETECTION_PROFILES_PATH}; using defaults.")
+        elif profile is not None:
+            print(f"Using detection profile '{name}'.")
+        _profile = {k: v for k, v in (profile or {}).items() if k in PROFILE_KEYS}
+    return _profile
+
+
+def create_detector(cascade, overrides=None, **defaults):
+    # FaceDetector with the caller's defaults overridden by the configured detection profile, and
+    # both by overrides (e.g. GROUP_SETTINGS).
+    settings = dict(defaults, **detection_profile())
+    settings.update(overrides or {})
+    return FaceDetector(cascade, **settings)
+
+
+def local_cascade(path=CASCADE_PATH):
+    # CascadeClassifier is not safe to share between threads, so each worker loads its own.
+    cascades = getattr(_local, 'cascades', None)
+    if cascades is None:
+        cascades = _local.cascades = {}
+    if path not in cascades:
+        cascades[path] = cv2.CascadeClassifier(path)
+    return cascades[path]
+
+
+def local_detector(path=CASCADE_PATH, overrides=None, **defaults):
+    # This thread's detector for the cascade at path, built once per thread with create_detector.
+    detectors = getattr(_local, 'detectors', None)
+    if detectors is None:
+        detectors = _local.detectors = {}
+    key = (path, tuple(sorted((overrides or {}).items())), tuple(sorted(defaults.items())))
+    if key not in detectors:
+        detectors[key] = create_detector(local_cascade(path), overrides, **defaults)
+    return detectors[key]
+
+
+def worker_detector(overrides=None):
+    # Detector for a worker process of a process pool, which already keeps every core busy, so
+    # OpenCV is limited to one thread in the process.
+    cv2.setNumThreads(1)
+    return create_detector(local_cascade(), overrides)
+
+
+def load_samples(folder):
+    # [(name, gray)] for the images in folder, plus {name: [boxes]} from its optional labels.csv
+    # (one 'file,x,y,w,h' row per face; labelled images without rows contain no face). Labels are
+    # None when the folder has no labels.csv.
+    names = sorted(name for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+    images = []
+    for name in names:
+        gray = cv2.imread(os.path.join(folder, name), cv2.IMREAD_GRAYSCALE)
+        if gray is not None:
+            images.append((name, gray))
+
+    labels_path = os.path.join(folder, 'labels.csv')
+    if not os.path.exists(labels_path):
+        return images, None
+    labels = {name: [] for name, _ in images}
+    with open(labels_path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) != 5 or not row[1].strip().lstrip('-').isdigit():
+                continue  # header or malformed row
+            labels.setdefault(row[0], []).append(tuple(int(v) for v in row[1:]))
+    return images, labels
+
+
+def count_hits(found, expected, min_iou=0.5):
+    # Expected boxes matched one-to-one by a found box with IoU >= min_iou.
+    remaining = list(found)
+    hits = 0
+    for box in expected:
+        best = max(remaining, key=lambda b: iou(b, box), default=None)
+        if best is not None and iou(best, box) >= min_iou:
+            remaining.remove(best)
+            hits += 1
+    return hits
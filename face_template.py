@@ -0,0 +1,36 @@
+import struct
+
+import cv2
+import numpy as np
+
+# 16-byte header: magic, format version, flags, height, width, padding.
+MAGIC = b'FTPL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHH4x')
+TEMPLATE_SIZE = (200, 200)
+
+
+def encode_template(face):
+    if face.ndim == 3:
+        face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    if face.shape[:2] != (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0]):
+        face = cv2.resize(face, TEMPLATE_SIZE)
+    face = np.ascontiguousarray(face, dtype=np.uint8)
+    height, width = face.shape
+    return HEADER.pack(MAGIC, VERSION, 0, height, width) + face.tobytes()
+
+
+def is_template(blob):
+    return blob is not None and len(blob) >= HEADER.size and bytes(blob[:4]) == MAGIC
+
+
+def decode_template(blob):
+    if not is_template(blob):
+        raise ValueError("Not a face template (legacy pickled row? run migrate-templates.py)")
+    _, version, _, height, width = HEADER.unpack_from(blob)
+    if version != VERSION:
+        raise ValueError(f"Unsupported face template version {version}")
+    if len(blob) != HEADER.size + height * width:
+        raise ValueError("Truncated face template")
+    # A view over the blob buffer; no pixel data is copied.
+    return np.frombuffer(blob, dtype=np.uint8, count=height * width, offset=HEADER.size).reshape(height, width)
@@ -0,0 +1,171 @@
+import itertools
+import threading
+
+import cv2
+
+from config import DETECT_EVERY, RECOGNIZE_RETRY, TRACK_MATCH_THRESHOLD, TRACK_MAX_MISSES, TRACK_SEARCH_MARGIN
+
+# Templates are matched at no more than this width, which keeps a frame's tracking well under
+# a millisecond regardless of how close the face is to the camera.
+MATCH_WIDTH = 48
+MIN_IOU = 0.3
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+class Track:
+    def __init__(self, track_id, box, gray, frame_index):
+        self.id = track_id
+        self.identity = None
+        self.recognized_at = None
+        self.recognizing = False
+        self.misses = 0
+        self.reset(box, gray, frame_index)
+
+    def reset(self, box, gray, frame_index):
+        # Re-anchors the track on a detector box; the template is only ever taken from detections
+        # so following it between detections cannot drift.
+        x, y, w, h = (int(v) for v in box)
+        self.box = (x, y, w, h)
+        self.scale = min(1.0, MATCH_WIDTH / float(w))
+        self.template = cv2.resize(gray[y:y + h, x:x + w], None, fx=self.scale, fy=self.scale)
+        self.detected_at = frame_index
+
+    def follow(self, gray):
+        # Template match inside the box grown by TRACK_SEARCH_MARGIN; False when the face is lost.
+        x, y, w, h = self.box
+        mx, my = int(w * TRACK_SEARCH_MARGIN), int(h * TRACK_SEARCH_MARGIN)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(gray.shape[1], x + w + mx), min(gray.shape[0], y + h + my)
+        roi = cv2.resize(gray[y0:y1, x0:x1], None, fx=self.scale, fy=self.scale)
+        th, tw = self.template.shape
+        if roi.shape[0] < th or roi.shape[1] < tw:
+            return False
+        _, score, _, (lx, ly) = cv2.minMaxLoc(cv2.matchTemplate(roi, self.template, cv2.TM_CCOEFF_NORMED))
+        if score < TRACK_MATCH_THRESHOLD:
+            return False
+        self.box = (x0 + int(lx / self.scale), y0 + int(ly / self.scale), w, h)
+        return True
+
+
+class FaceTracker:
+    # Runs detect(gray) on every DETECT_EVERY-th frame, or straight away when a track is lost,
+    # and follows faces with a template match in between. recognize(gray, box) runs once per
+    # new track and its result is cached on the track; a result that accepts = False is
+    # retried every RECOGNIZE_RETRY frames. The lock only covers track bookkeeping: detect and
+    # recognize run outside it, so pipeline workers overlap on them, and a detection is applied
+    # only if no newer frame's detection has been. Frames older than the last one processed get
+    # the current tracks. recognize may return None to skip a poor crop, in which case it is
+    # tried again on the next frame. With a motion gate, frames where nothing moved keep the
+    # previous tracks.
+
+    def __init__(self, detect, recognize=None, accepts=None, detect_every=DETECT_EVERY, motion=None):
+        self.detect = detect
+        self.recognize = recognize
+        self.accepts = accepts
+        self.motion = motion
+        self.detect_every = max(1, detect_every)
+        self.tracks = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.last_index = -1
+        self.last_detection = None
+        self.applied_detection = -1
+        self.frames = 0
+        self.detections = 0
+        self.recognitions = 0
+
+    def _apply_detection(self, boxes, gray, index):
+        # Matches the boxes detected in frame `index` to the tracks; called with the lock held.
+        boxes = sorted((tuple(int(v) for v in box) for box in boxes), key=lambda b: b[2] * b[3], reverse=True)
+        self.applied_detection = index
+
+        unmatched = list(self.tracks)
+        tracks = []
+        for box in boxes:
+            best = max(unmatched, key=lambda t: iou(t.box, box), default=None)
+            if best is not None and iou(best.box, box) >= MIN_IOU:
+                unmatched.remove(best)
+                best.reset(box, gray, index)
+                best.misses = 0
+                tracks.append(best)
+            else:
+                tracks.append(Track(next(self.ids), box, gray, index))
+
+        # Haar misses the odd frame; keep a track the template can still follow for a few detections.
+        for track in unmatched:
+            track.misses += 1
+            if track.misses <= TRACK_MAX_MISSES and track.follow(gray):
+                tracks.append(track)
+        self.tracks = tracks
+
+    def _claim_recognitions(self, index):
+        # (track, box) for the tracks due a recognition, marked so other workers skip them;
+        # called with the lock held.
+        claimed = []
+        for track in self.tracks:
+            if track.recognizing:
+                continue
+            if track.recognized_at is not None:
+                if self.accepts is None or self.accepts(track.identity):
+                    continue
+                if index - track.recognized_at < RECOGNIZE_RETRY:
+                    continue
+            track.recognizing = True
+            claimed.append((track, track.box))
+        return claimed
+
+    def _recognize(self, gray, index):
+        with self.lock:
+            claimed = self._claim_recognitions(index)
+        for track, box in claimed:
+            identity = None
+            try:
+                identity = self.recognize(gray, box)
+            finally:
+                with self.lock:
+                    track.recognizing = False
+                    if identity is not None:
+                        track.identity = identity
+                        track.recognized_at = index
+                        self.recognitions += 1
+
+    def _current(self):
+        return [(track.id, track.box, track.identity) for track in self.tracks]
+
+    def update(self, gray, index):
+        # [(track_id, box, identity)] for the faces in this frame.
+        with self.lock:
+            if index <= self.last_index or (self.motion is not None and not self.motion.changed(gray)):
+                return self._current()
+            self.last_index = index
+            self.frames += 1
+            due = self.last_detection is None or index - self.last_detection >= self.detect_every
+            detect = due or not all(track.follow(gray) for track in self.tracks)
+            if detect:
+                self.last_detection = index
+                self.detections += 1
+
+        if detect:
+            boxes = self.detect(gray)
+            with self.lock:
+                if index > self.applied_detection:
+                    self._apply_detection(boxes, gray, index)
+        if self.recognize is not None:
+            self._recognize(gray, index)
+        with self.lock:
+            return self._current()
+
+    def stats_text(self):
+        detected = 100.0 * self.detections / self.frames if self.frames else 0.0
+        return (f"{self.frames} frame(s), full detection on {detected:.0f}%, "
+                f"{self.recognitions} recognition(s)")
@@ -0,0 +1,83 @@
+import threading
+from collections import Counter
+
+import cv2
+
+from config import (MOTION_MAX_SKIP, MOTION_MIN_CHANGE, MOTION_THRESHOLD, QUALITY_MAX_BRIGHTNESS,
+                    QUALITY_MIN_BRIGHTNESS, QUALITY_MIN_SHARPNESS)
+from face_template import TEMPLATE_SIZE
+
+# Frames are compared at this size; enough to see a person move, cheap enough for every frame.
+MOTION_SIZE = (80, 60)
+
+
+class MotionGate:
+    # Frame differencing against the last frame that was let through: a frame passes when more
+    # than min_change of its (downscaled, blurred) pixels moved by more than threshold grey
+    # levels, or after max_skip static frames in a row so results never go stale for long.
+
+    def __init__(self, threshold=MOTION_THRESHOLD, min_change=MOTION_MIN_CHANGE, max_skip=MOTION_MAX_SKIP):
+        self.threshold = threshold
+        self.min_change = min_change
+        self.max_skip = max_skip
+        self.reference = None
+        self.static_run = 0
+        self.frames = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def changed(self, gray):
+        small = cv2.GaussianBlur(cv2.resize(gray, MOTION_SIZE, interpolation=cv2.INTER_AREA), (5, 5), 0)
+        with self.lock:
+            self.frames += 1
+            if self.reference is not None and self.static_run < self.max_skip:
+                diff = cv2.absdiff(small, self.reference)
+                moved = cv2.countNonZero(cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1])
+                if moved < self.min_change * diff.size:
+                    self.static_run += 1
+                    self.skipped += 1
+                    return False
+            self.reference = small
+            self.static_run = 0
+            return True
+
+    def stats_text(self):
+        return f"{self.skipped}/{self.frames} static frame(s) skipped"
+
+
+class QualityGate:
+    # Rejects face crops that are too blurry (variance of the Laplacian) or badly exposed (mean
+    # brightness) to recognize, counting each reason.
+
+    def __init__(self, min_sharpness=QUALITY_MIN_SHARPNESS, min_brightness=QUALITY_MIN_BRIGHTNESS,
+                 max_brightness=QUALITY_MAX_BRIGHTNESS):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.checked = 0
+        self.rejected = Counter()
+        self.lock = threading.Lock()
+
+    def problem(self, crop):
+        # None for a usable crop, otherwise 'blurry', 'too dark' or 'too bright'. Sharpness is
+        # measured at template size so the threshold does not depend on how big the face is.
+        if crop.shape[:2] != (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0]):
+            crop = cv2.resize(crop, TEMPLATE_SIZE)
+        brightness = float(crop.mean())
+        if brightness < self.min_brightness:
+            reason = 'too dark'
+        elif brightness > self.max_brightness:
+            reason = 'too bright'
+        elif cv2.Laplacian(crop, cv2.CV_64F).var() < self.min_sharpness:
+            reason = 'blurry'
+        else:
+            reason = None
+        with self.lock:
+            self.checked += 1
+            if reason:
+                self.rejected[reason] += 1
+        return reason
+
+    def stats_text(self):
+        rejected = ', '.join(f"{count} {reason}" for reason, count in self.rejected.most_common())
+        return f"{sum(self.rejected.values())}/{self.checked} crop(s) rejected" + (f" ({rejected})" if rejected else "")
@@ -0,0 +1,218 @@
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writers are not serialized across processes.
+    fcntl = None
+
+from config import GALLERY_DIR
+from face_template import HEADER, TEMPLATE_SIZE, encode_template, is_template
+
+TEMPLATE_SHAPE = (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0])
+TEMPLATE_BYTES = TEMPLATE_SHAPE[0] * TEMPLATE_SHAPE[1]
+LABEL_BYTES = 8
+TEMPLATES_FILE = 'templates.bin'
+LABELS_FILE = 'labels.bin'
+META_FILE = 'gallery.json'
+LOCK_FILE = 'gallery.lock'
+COMPACT_RATIO = 0.25
+DELETED = 0
+
+
+class GalleryStore:
+    # templates.bin is N contiguous 200x200 uint8 records and labels.bin the matching int64
+    # student ids (0 marks a deleted record). Both are opened read-only with np.memmap, so
+    # every process mapping the same files shares one copy through the OS page cache.
+
+    def __init__(self, gallery_dir=GALLERY_DIR):
+        self.gallery_dir = gallery_dir
+        self.templates = np.empty((0,) + TEMPLATE_SHAPE, dtype=np.uint8)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.meta = None
+
+    def _path(self, name):
+        return os.path.join(self.gallery_dir, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path(META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, fingerprint):
+        self.meta = {'fingerprint': fingerprint, 'template_shape': list(TEMPLATE_SHAPE)}
+        tmp = self._path(META_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path(META_FILE))
+
+    @contextmanager
+    def _locked(self):
+        # Every write holds an exclusive flock on gallery.lock, so appends, deletes and rebuilds from
+        # several processes (or threads) never interleave. Readers map whole records and need none.
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _record_count(self):
+        # A crash between the two appends can leave a partial record; only whole pairs count.
+        try:
+            return min(os.path.getsize(self._path(TEMPLATES_FILE)) // TEMPLATE_BYTES,
+                       os.path.getsize(self._path(LABELS_FILE)) // LABEL_BYTES)
+        except OSError:
+            return 0
+
+    @property
+    def fingerprint(self):
+        return self.meta.get('fingerprint') if self.meta else None
+
+    def open(self):
+        meta = self._read_meta()
+        if meta is None or tuple(meta.get('template_shape', ())) != TEMPLATE_SHAPE:
+            self.meta = None
+            return False
+
+        count = self._record_count()
+        if count:
+            self.templates = np.memmap(self._path(TEMPLATES_FILE), dtype=np.uint8, mode='r',
+                                       shape=(count,) + TEMPLATE_SHAPE)
+            self.labels = np.memmap(self._path(LABELS_FILE), dtype=np.int64, mode='r', shape=(count,))
+        else:
+            self.templates = np.empty((0,) + TEMPLATE_SHAPE, dtype=np.uint8)
+            self.labels = np.empty(0, dtype=np.int64)
+        self.meta = meta
+        return True
+
+    def faces(self):
+        live = np.flatnonzero(self.labels != DELETED)
+        return [self.templates[i] for i in live], self.labels[live].tolist()
+
+    def build(self, rows, fingerprint):
+        # rows yields (student_id, face_blob); template pixels are copied straight from the blobs.
+        with self._locked():
+            tmp_templates = self._path(TEMPLATES_FILE + '.tmp')
+            ids = []
+            with open(tmp_templates, 'wb') as f:
+                for student_id, face_blob in rows:
+                    if not is_template(face_blob) or len(face_blob) != HEADER.size + TEMPLATE_BYTES:
+                        continue
+                    f.write(memoryview(face_blob)[HEADER.size:])
+                    ids.append(student_id)
+
+            tmp_labels = self._path(LABELS_FILE + '.tmp')
+            np.asarray(ids, dtype=np.int64).tofile(tmp_labels)
+            os.replace(tmp_templates, self._path(TEMPLATES_FILE))
+            os.replace(tmp_labels, self._path(LABELS_FILE))
+            self._write_meta(fingerprint)
+            self.open()
+        print(f"Built face gallery with {len(ids)} template(s).")
+        return len(ids)
+
+    def append(self, student_id, face, fingerprint):
+        raw = memoryview(encode_template(face))[HEADER.size:]
+        with self._locked():
+            if not self.open():
+                return False
+            self._tombstone(student_id)
+
+            # Counted under the lock: another writer may have appended since this process last looked.
+            count = self._record_count()
+            with open(self._path(TEMPLATES_FILE), 'r+b') as f:
+                f.truncate(count * TEMPLATE_BYTES)
+                f.seek(0, os.SEEK_END)
+                f.write(raw)
+            with open(self._path(LABELS_FILE), 'r+b') as f:
+                f.truncate(count * LABEL_BYTES)
+                f.seek(0, os.SEEK_END)
+                f.write(np.int64(student_id).tobytes())
+            self._write_meta(fingerprint)
+            self.open()
+            return True
+
+    def delete(self, student_id, fingerprint):
+        with self._locked():
+            if not self.open():
+                return False
+            self._tombstone(student_id)
+            self._write_meta(fingerprint)
+            self.open()
+            if len(self.labels) and np.count_nonzero(self.labels == DELETED) > COMPACT_RATIO * len(self.labels):
+                self._compact()
+            return True
+
+    def set_fingerprint(self, fingerprint):
+        with self._locked():
+            if self.open():
+                self._write_meta(fingerprint)
+
+    def _tombstone(self, student_id):
+        count = self._record_count()
+        if not count:
+            return
+        labels = np.memmap(self._path(LABELS_FILE), dtype=np.int64, mode='r+', shape=(count,))
+        hits = labels == student_id
+        if hits.any():
+            labels[hits] = DELETED
+            labels.flush()
+        del labels
+
+    def compact(self):
+        with self._locked():
+            if not self.open():
+                return 0
+            return self._compact()
+
+    def _compact(self):
+        # Called with the lock held and the store freshly opened.
+        live = np.flatnonzero(self.labels != DELETED)
+        tmp_templates = self._path(TEMPLATES_FILE + '.tmp')
+        with open(tmp_templates, 'wb') as f:
+            for start in range(0, len(live), 1024):
+                f.write(np.ascontiguousarray(self.templates[live[start:start + 1024]]).tobytes())
+        tmp_labels = self._path(LABELS_FILE + '.tmp')
+        np.asarray(self.labels[live], dtype=np.int64).tofile(tmp_labels)
+
+        # Readers that still map the old files keep their inode until they reopen.
+        os.replace(tmp_templates, self._path(TEMPLATES_FILE))
+        os.replace(tmp_labels, self._path(LABELS_FILE))
+        self._write_meta(self.fingerprint)
+        self.open()
+        print(f"Compacted face gallery to {len(live)} template(s).")
+        return len(live)
+
+
+def sync_gallery(store, student_id, fingerprint, face=None, deleted=False):
+    if face is not None:
+        return store.append(student_id, face, fingerprint)
+    if deleted:
+        return store.delete(student_id, fingerprint)
+    store.set_fingerprint(fingerprint)
+    return True
+
+
+def load_gallery(conn, store, fingerprint, department=None):
+    where, params = "face_image IS NOT NULL", ()
+    if department is not None:
+        where += " AND COALESCE(department, '') = %s"
+        params = (department,)
+
+    cursor = conn.cursor()
+    if not store.open() or store.fingerprint != fingerprint:
+        cursor.execute(f"SELECT id, face_image FROM students WHERE {where} ORDER BY id", params)
+        store.build(cursor, fingerprint)
+
+    cursor.execute(f"SELECT id, name, roll_number, department FROM students WHERE {where}", params)
+    students = {row[0]: {'name': row[1], 'roll': row[2], 'dept': row[3]} for row in cursor}
+    cursor.close()
+
+    faces, labels = store.faces()
+    keep = [i for i, student_id in enumerate(labels) if student_id in students]
+    return [faces[i] for i in keep], [labels[i] for i in keep], students
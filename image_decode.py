@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+from face_template import TEMPLATE_SIZE
+
+REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class EncodedImage:
+    # Decodes an encoded (JPEG/PNG) buffer straight to grayscale, optionally at 1/2, 1/4 or 1/8
+    # size for detection. Full resolution is decoded only if a face is too small in the reduced
+    # image to fill a template without upscaling.
+
+    def __init__(self, image_bytes, reduction=1):
+        self.buffer = np.frombuffer(image_bytes, np.uint8)
+        self.reduction = reduction if reduction in REDUCED_GRAYSCALE else 1
+        self.gray = cv2.imdecode(self.buffer, REDUCED_GRAYSCALE[self.reduction])
+        if self.gray is None:
+            raise ValueError("Could not decode image")
+        self._full = None
+
+    def full(self):
+        if self._full is None:
+            self._full = self.gray if self.reduction == 1 else cv2.imdecode(self.buffer, cv2.IMREAD_GRAYSCALE)
+        return self._full
+
+    def to_full(self, box):
+        x, y, w, h = (int(v) * self.reduction for v in box)
+        return x, y, w, h
+
+    def crop(self, box):
+        x, y, w, h = (int(v) for v in box)
+        if self.reduction == 1 or min(w, h) >= min(TEMPLATE_SIZE):
+            return cv2.resize(self.gray[y:y + h, x:x + w], TEMPLATE_SIZE)
+        x, y, w, h = self.to_full(box)
+        return cv2.resize(self.full()[y:y + h, x:x + w], TEMPLATE_SIZE)
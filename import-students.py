@@ -0,0 +1,225 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+import schema
+from config import DECODE_REDUCTION
+from db import get_db_connection
+from face_detect import IMAGE_EXTENSIONS, worker_detector
+from face_template import encode_template
+from frame_gate import QualityGate
+from image_decode import EncodedImage
+from recognizer_shards import ShardedRecognizer
+
+BATCH_SIZE = 500
+ROLL_COLUMNS = ('roll_number', 'roll', 'roll_no')
+NAME_COLUMNS = ('name', 'student_name')
+DEPARTMENT_COLUMNS = ('department', 'dept')
+
+# Per worker process, set up by init_worker.
+detector = None
+quality = None
+
+
+def init_worker():
+    global detector, quality
+    detector = worker_detector()
+    quality = QualityGate()
+
+
+def pick(row, columns):
+    for column in columns:
+        value = (row.get(column) or '').strip()
+        if value:
+            return value
+    return ''
+
+
+def read_roster(path):
+    # [(line, roll, name, department)] plus [(line, roll, reason)] for rows that cannot be imported.
+    students, problems = [], []
+    seen = set()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [(name or '').strip().lower() for name in reader.fieldnames or []]
+        for row in reader:
+            line = reader.line_num
+            roll, name, department = pick(row, ROLL_COLUMNS), pick(row, NAME_COLUMNS), pick(row, DEPARTMENT_COLUMNS)
+            if not roll or not name:
+                problems.append((line, roll, 'missing roll number or name'))
+            elif roll in seen:
+                problems.append((line, roll, 'duplicate roll number in roster'))
+            else:
+                seen.add(roll)
+                students.append((line, roll, name, department or None))
+    return students, problems
+
+
+def student_photos(photos_dir, roll):
+    # The photos in photos_dir/<roll>/, or a single photos_dir/<roll>.<ext>.
+    folder = os.path.join(photos_dir, roll)
+    if os.path.isdir(folder):
+        return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+    return [os.path.join(photos_dir, roll + ext) for ext in IMAGE_EXTENSIONS
+            if os.path.isfile(os.path.join(photos_dir, roll + ext))]
+
+
+def enroll_photos(roll, paths):
+    # (roll, template blob or None, [(file, reason)] for rejected photos, seconds). A photo is used
+    # only if it shows exactly one face of usable quality; of those the sharpest becomes the template.
+    began = time.perf_counter()
+    best, best_sharpness = None, -1.0
+    rejected = []
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            with open(path, 'rb') as f:
+                image = EncodedImage(f.read(), DECODE_REDUCTION)
+        except (OSError, ValueError):
+            rejected.append((name, 'unreadable image'))
+            continue
+        faces = detector.detect(image.gray)
+        if len(faces) != 1:
+            rejected.append((name, 'no face' if not faces else 'multiple faces'))
+            continue
+        crop = image.crop(faces[0])
+        problem = quality.problem(crop)
+        if problem:
+            rejected.append((name, problem))
+            continue
+        sharpness = cv2.Laplacian(crop, cv2.CV_64F).var()
+        if sharpness > best_sharpness:
+            best, best_sharpness = crop, sharpness
+    blob = encode_template(best) if best is not None else None
+    return roll, blob, rejected, time.perf_counter() - began
+
+
+def existing_rolls(cursor, rolls):
+    found = set()
+    rolls = list(rolls)
+    for start in range(0, len(rolls), BATCH_SIZE):
+        chunk = rolls[start:start + BATCH_SIZE]
+        cursor.execute(f"SELECT roll_number FROM students WHERE roll_number IN ({', '.join(['%s'] * len(chunk))})",
+                       chunk)
+        found.update(row[0] for row in cursor)
+    return found
+
+
+def write_batch(conn, cursor, rows, update):
+    # One transaction per batch; a failed batch is rolled back and reported without stopping the import.
+    sql = "INSERT INTO students (name, roll_number, department, face_image) VALUES (%s, %s, %s, %s)"
+    if update:
+        sql += (" ON DUPLICATE KEY UPDATE name = VALUES(name), department = VALUES(department), "
+                "face_image = VALUES(face_image)")
+    try:
+        cursor.executemany(sql, rows)
+        conn.commit()
+        return None
+    except Exception as e:
+        conn.rollback()
+        return str(e)
+
+
+def write_report(path, failures):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['roll_number', 'photo', 'reason'])
+        writer.writerows(failures)
+
+
+def run(args):
+    students, problems = read_roster(args.roster)
+    failures = [(roll, '', f"line {line}: {reason}") for line, roll, reason in problems]
+    print(f" {len(students)} student(s) in roster, {len(problems)} row(s) rejected")
+
+    conn = get_db_connection()
+    schema.migrate(conn)
+    cursor = conn.cursor()
+    existing = existing_rolls(cursor, (roll for _, roll, _, _ in students))
+    if existing and not args.update:
+        print(f" Skipping {len(existing)} student(s) already enrolled (use --update to replace them)")
+        students = [student for student in students if student[1] not in existing]
+
+    rosters = {}
+    jobs = []
+    for _, roll, name, department in students:
+        paths = student_photos(args.photos, roll)
+        if not paths:
+            failures.append((roll, '', 'no photos'))
+            continue
+        rosters[roll] = (name, department)
+        jobs.append((roll, paths))
+    photos = sum(len(paths) for _, paths in jobs)
+    print(f" Detecting faces in {photos} photo(s) of {len(jobs)} student(s) on {args.workers} process(es)")
+
+    started = time.perf_counter()
+    batch = []
+    written = busy_seconds = 0
+    failed_batches = 0
+    reasons = Counter()
+    # Spawned, not forked: a forked worker would inherit the pooled MySQL connection opened above
+    # and share its socket with this process.
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(enroll_photos, roll, paths) for roll, paths in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            roll, blob, rejected, seconds = future.result()
+            busy_seconds += seconds
+            for name, reason in rejected:
+                reasons[reason] += 1
+                failures.append((roll, name, reason))
+            if blob is None:
+                failures.append((roll, '', 'no usable photo'))
+            else:
+                name, department = rosters[roll]
+                batch.append((name, roll, department, blob))
+
+            # Rows are written while the pool keeps detecting, in transactions of args.batch_size.
+            if batch and (len(batch) >= args.batch_size or done == len(futures)):
+                error = None if args.dry_run else write_batch(conn, cursor, batch, args.update)
+                if error:
+                    failed_batches += 1
+                    failures.extend((row[1], '', f"database: {error}") for row in batch)
+                else:
+                    written += len(batch)
+                batch = []
+            print(f"\r Processed {done}/{len(jobs)} student(s), {written} written", end='', flush=True)
+    cursor.close()
+    conn.close()
+    elapsed = max(time.perf_counter() - started, 1e-6)
+
+    print(f"\n {'Would write' if args.dry_run else 'Wrote'} {written} student(s) in {elapsed:.1f}s: "
+          f"{len(jobs) / elapsed:.1f} student(s)/s, {photos / elapsed:.1f} photo(s)/s, "
+          f"{busy_seconds / elapsed:.1f} of {args.workers} process(es) busy on average")
+    if failed_batches:
+        print(f" {failed_batches} batch(es) failed to write and were rolled back")
+    if reasons:
+        print(" Rejected photos: " + ', '.join(f"{count} {reason}" for reason, count in reasons.most_common()))
+    if failures:
+        write_report(args.report, failures)
+        print(f" {len(failures)} problem(s) written to {args.report}")
+
+    if written and not args.dry_run and not args.no_train:
+        # Train the snapshots once here so running services load them instead of each retraining.
+        print(" Training recognizer snapshots...")
+        print(f" Loaded {ShardedRecognizer().load_all()} recognizer shard(s).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll students in bulk from a roster CSV and their photos")
+    parser.add_argument('roster', help="CSV with roll_number, name and department columns")
+    parser.add_argument('photos', help="folder with a sub-folder (or one <roll>.jpg) of photos per roll number")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="students written per transaction")
+    parser.add_argument('--update', action='store_true', help="replace the name, department and face of "
+                                                              "students already enrolled")
+    parser.add_argument('--report', default='import-failures.csv', help="where to write rejected rows and photos")
+    parser.add_argument('--no-train', action='store_true', help="leave retraining to the running services")
+    parser.add_argument('--dry-run', action='store_true', help="detect and report without writing to the database")
+    run(parser.parse_args())
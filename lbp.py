@@ -0,0 +1,77 @@
+import numpy as np
+
+# Same operator and layout as cv2.face.LBPHFaceRecognizer_create() defaults, so distances are
+# comparable with the confidence values returned by its predict().
+RADIUS = 1
+NEIGHBORS = 8
+GRID_X = 8
+GRID_Y = 8
+EPSILON = np.finfo(np.float32).eps
+
+
+def lbp_image(face, radius=RADIUS, neighbors=NEIGHBORS):
+    # Works on one (H, W) face or a stack of them, (N, H, W).
+    src = np.asarray(face, dtype=np.float32)
+    rows, cols = src.shape[-2:]
+    center = src[..., radius:rows - radius, radius:cols - radius]
+
+    def shifted(dy, dx):
+        return src[..., radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+
+    codes = np.zeros(center.shape, dtype=np.int32)
+    for n in range(neighbors):
+        # Circular neighbourhood sampled with bilinear interpolation, as in OpenCV's elbp().
+        # Weights stay in float32 like OpenCV's, so ties against the centre resolve identically.
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = x - np.float32(fx), y - np.float32(fy)
+        one = np.float32(1)
+        w1, w2, w3, w4 = (one - tx) * (one - ty), tx * (one - ty), (one - tx) * ty, tx * ty
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        codes += (((t > center) | (np.abs(t - center) < EPSILON)).astype(np.int32) << n)
+    return codes
+
+
+def spatial_histogram(codes, bins=2 ** NEIGHBORS, grid_x=GRID_X, grid_y=GRID_Y):
+    single = codes.ndim == 2
+    codes = codes.reshape((-1,) + codes.shape[-2:])
+    count = codes.shape[0]
+    cells_per_face = grid_y * grid_x
+    height, width = codes.shape[1] // grid_y, codes.shape[2] // grid_x
+    cells = codes[:, :grid_y * height, :grid_x * width].reshape(count, grid_y, height, grid_x, width)
+    cells = cells.transpose(0, 1, 3, 2, 4).reshape(count * cells_per_face, height * width)
+    offsets = (np.arange(count * cells_per_face) * bins)[:, None]
+    hist = np.bincount((cells + offsets).ravel(), minlength=count * cells_per_face * bins).astype(np.float32)
+    hist = hist.reshape(count, cells_per_face * bins) / np.float32(height * width)
+    return hist[0] if single else hist
+
+
+def face_histogram(face):
+    return spatial_histogram(lbp_image(face))
+
+
+def face_histograms(faces, chunk=64):
+    # (N, D) float32 histograms for a list of equally sized faces, computed a chunk at a time.
+    if not len(faces):
+        return np.empty((0, GRID_X * GRID_Y * 2 ** NEIGHBORS), dtype=np.float32)
+    return np.vstack([spatial_histogram(lbp_image(np.stack(faces[start:start + chunk])))
+                      for start in range(0, len(faces), chunk)])
+
+
+def chi_square_distances(probes, gallery):
+    # HISTCMP_CHISQR_ALT, sum(2 (a - b)^2 / (a + b)), for every (probe, gallery) pair at once.
+    probes = np.atleast_2d(probes)[:, None, :]
+    gallery = np.atleast_2d(gallery)[None, :, :]
+    diff = probes - gallery
+    total = probes + gallery
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(total > EPSILON, 2 * diff * diff / total, 0)
+    return terms.sum(axis=-1)
+
+
+def l1_distances(probes, gallery):
+    probes = np.atleast_2d(probes)[:, None, :]
+    gallery = np.atleast_2d(gallery)[None, :, :]
+    return np.abs(probes - gallery).sum(axis=-1)
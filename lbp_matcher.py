@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+from ann_index import IVFIndex
+from config import MATCH_BLOCK_BYTES, RECOGNIZER_BACKEND
+from lbp import GRID_X, GRID_Y, NEIGHBORS, chi_square_distances, face_histograms, l1_distances
+
+HISTOGRAM_SIZE = GRID_X * GRID_Y * 2 ** NEIGHBORS
+METRICS = {'chi2': chi_square_distances, 'l1': l1_distances}
+
+
+class LBPMatcher:
+    # Pure NumPy stand-in for cv2.face.LBPHFaceRecognizer: the gallery is one (N, D) float32
+    # histogram matrix, and a batch of probes is scored against all of it in one vectorized
+    # pass with top-k results. train/update/predict/write/read mirror the OpenCV interface,
+    # and with the default chi2 metric distances equal LBPH confidences.
+
+    FILE_EXTENSION = '.npz'
+
+    def __init__(self, metric='chi2'):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'")
+        self.metric = metric
+        self.histograms = np.empty((0, HISTOGRAM_SIZE), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def train(self, faces, labels):
+        self.histograms = face_histograms(list(faces))
+        self.labels = np.asarray(labels, dtype=np.int64).ravel()
+
+    def update(self, faces, labels):
+        self.histograms = np.vstack([self.histograms, face_histograms(list(faces))])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int64).ravel()])
+
+    def remove(self, label):
+        keep = self.labels != label
+        self.histograms, self.labels = self.histograms[keep], self.labels[keep]
+
+    def distances(self, probes):
+        # (B, N) distance matrix, built a gallery block at a time to cap temporary memory.
+        probes = np.atleast_2d(probes).astype(np.float32, copy=False)
+        distance = METRICS[self.metric]
+        out = np.empty((len(probes), len(self.labels)), dtype=np.float32)
+        block = max(1, MATCH_BLOCK_BYTES // (len(probes) * HISTOGRAM_SIZE * 4))
+        for start in range(0, len(self.labels), block):
+            out[:, start:start + block] = distance(probes, self.histograms[start:start + block])
+        return out
+
+    def match(self, probes, k=1):
+        # Top-k (labels, distances), each (B, k) and sorted by distance.
+        probes = np.atleast_2d(probes)
+        if not len(self.labels):
+            return (np.full((len(probes), k), -1, dtype=np.int64),
+                    np.full((len(probes), k), np.inf, dtype=np.float32))
+        distances = self.distances(probes)
+        k = min(k, distances.shape[1])
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        return self.labels[nearest], np.take_along_axis(distances, nearest, axis=1)
+
+    def predict_batch(self, faces, k=1):
+        return self.match(face_histograms(list(faces)), k)
+
+    def predict(self, face):
+        labels, distances = self.predict_batch([face])
+        return int(labels[0, 0]), float(distances[0, 0])
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, histograms=self.histograms, labels=self.labels, metric=np.array(self.metric))
+
+    def read(self, path):
+        with np.load(path) as data:
+            self.histograms = data['histograms']
+            self.labels = data['labels']
+            self.metric = str(data['metric'])
+
+
+def create_recognizer(backend=RECOGNIZER_BACKEND):
+    if backend == 'numpy':
+        return LBPMatcher()
+    if backend == 'ivf':
+        return IVFIndex()
+    return cv2.face.LBPHFaceRecognizer_create()
+
+
+def predict_many(recognizer, faces):
+    # [(label, distance)] for each face, batched when the backend supports it.
+    if hasattr(recognizer, 'predict_batch'):
+        labels, distances = recognizer.predict_batch(faces)
+        return [(int(label), float(distance)) for label, distance in zip(labels[:, 0], distances[:, 0])]
+    return [recognizer.predict(face) for face in faces]
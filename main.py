@@ -1,33 +1,55 @@
 from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
-import cv2
-import pickle
-import mysql.connector
 import numpy as np
 from datetime import datetime
 import bcrypt
 import base64
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import functools
+import threading
+import time
 import urllib.request
 
+import metrics
+import schema
+from admission import AdmissionController
+from attendance_writer import get_writer
+from config import (BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_WORKERS, CONFIDENCE_THRESHOLD, DECODE_REDUCTION,
+                    KIOSK_DEPARTMENT, RECOGNITION_PROCESSES, VERIFY_CACHE_SIZE)
+from db import get_db_connection, pool_stats
+from face_detect import GROUP_SETTINGS, local_detector
+from face_template import decode_template, encode_template
+from image_decode import EncodedImage
+from lbp import chi_square_distances, face_histogram
+from marked_today import marked_today
+from recognition_pool import RecognitionPool
+from recognizer_shards import ShardedRecognizer
+from request_batcher import RequestBatcher
+
 app = Flask(__name__)
 CORS(app)
 app.secret_key = 'your-secret-key-here'
 
 camera = None
-recognizer = None
-face_cascade = None
+shards = ShardedRecognizer()
+admission = AdmissionController()
+template_histograms = OrderedDict()
+template_histograms_lock = threading.Lock()
+recognition_pool = None
+
 
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '',
-    'database': 'face_attendance'
-}
+@app.before_request
+def start_request_timing():
+    metrics.begin_request()
 
 
-def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+@app.after_request
+def finish_request_timing(response):
+    metrics.end_request(request.endpoint or 'unknown', request.method, response.status_code)
+    return response
 
 
 def download_haar_cascade():
@@ -41,12 +63,11 @@ def download_haar_cascade():
 
 
 def initialize_face_detection():
-    global face_cascade
+    # Request threads and recognition workers each load their own cascade from this file.
     try:
         cascade_path = download_haar_cascade()
-        face_cascade = cv2.CascadeClassifier(cascade_path)
-        if face_cascade.empty():
-            raise Exception("Cascade classifier not loaded")
+        if not os.path.exists(cascade_path):
+            raise Exception("Cascade file not found")
         print("Face detection initialized.")
         return True
     except Exception as e:
@@ -54,49 +75,6 @@ def initialize_face_detection():
         return False
 
 
-def load_faces_from_db():
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, name, roll_number, department, face_image FROM students WHERE face_image IS NOT NULL")
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        faces, labels, label_map = [], [], {}
-        for row in rows:
-            student_id, name, roll, dept, face_blob = row
-            try:
-                face = pickle.loads(face_blob)
-                faces.append(face)
-                labels.append(student_id)
-                label_map[student_id] = {'name': name, 'roll': roll, 'dept': dept}
-            except:
-                continue
-
-        return faces, labels, label_map
-    except Exception as e:
-        print(f"Error loading faces: {e}")
-        return [], [], {}
-
-
-def train_recognizer():
-    global recognizer
-    try:
-        faces, labels, label_map = load_faces_from_db()
-        if faces:
-            recognizer = cv2.face.LBPHFaceRecognizer_create()
-            recognizer.train(faces, np.array(labels))
-            print(f"Trained on {len(faces)} face(s).")
-            return True, label_map
-        else:
-            return False, {}
-    except Exception as e:
-        print(f"Recognizer error: {e}")
-        return False, {}
-
-
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -135,112 +113,424 @@ def register_student():
         return jsonify({'success': False, 'message': str(e)})
 
 
+def request_data():
+    # JSON bodies carry fields inline; multipart and raw image bodies use form fields or the query string.
+    if request.is_json:
+        return request.get_json()
+    data = request.args.to_dict()
+    data.update(request.form.to_dict())
+    return data
+
+
+def request_image_bytes(data):
+    # Accepts a multipart 'image' file, a raw image/* body, or the legacy base64 data URL in JSON.
+    with metrics.stage('read'):
+        if 'image' in request.files:
+            image_bytes = request.files['image'].read()
+        elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+            image_bytes = request.get_data(cache=False)
+        elif data.get('image_data'):
+            image_bytes = base64.b64decode(data['image_data'].split(',')[-1])
+        else:
+            return None
+    return image_bytes or None
+
+
+def request_image(data):
+    image_bytes = request_image_bytes(data)
+    if image_bytes is None:
+        return None
+    with metrics.stage('decode'):
+        return EncodedImage(image_bytes, DECODE_REDUCTION)
+
+
+def request_kiosk():
+    # Fairness key for admission: the kiosk's own id if it sends one, else its address.
+    return request.headers.get('X-Kiosk-Id') or request.args.get('kiosk_id') or request.remote_addr
+
+
+def request_deadline():
+    # Unix time after which the client no longer wants an answer.
+    try:
+        return float(request.headers['X-Request-Deadline'])
+    except (KeyError, ValueError):
+        return None
+
+
+def admission_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with metrics.stage('admission'):
+            ticket = admission.enter(request_kiosk(), request_deadline())
+        if ticket.rejected:
+            status = 504 if ticket.rejected == 'deadline passed' else 503
+            response = jsonify({'success': False, 'message': f'Server busy ({ticket.rejected}), try again later',
+                                'retry_after': ticket.retry_after})
+            return response, status, {'Retry-After': str(ticket.retry_after)}
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.leave(ticket)
+    return wrapper
+
+
 @app.route('/api/capture_face', methods=['POST'])
+@admission_required
 def capture_face():
     try:
-        data = request.json
+        data = request_data()
         student_id = data.get('student_id')
-        image_data = data.get('image_data')
+        image = request_image(data)
 
-        if not student_id or not image_data:
+        if not student_id or image is None:
             return jsonify({'success': False, 'message': 'Missing data'})
 
-        image_data = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+        # A cascade per request thread: CascadeClassifier is not safe to share between threads.
+        with metrics.stage('detect'):
+            faces = local_detector().detect(image.gray)
+        metrics.inc('face_faces_detected_total', len(faces), endpoint=request.endpoint)
         if not len(faces):
             return jsonify({'success': False, 'message': 'No face detected'})
 
-        (x, y, w, h) = max(faces, key=lambda f: f[2] * f[3])
-        face_crop = gray[y:y + h, x:x + w]
-        face_resized = cv2.resize(face_crop, (200, 200))
+        face_resized = image.crop(max(faces, key=lambda f: f[2] * f[3]))
 
-        face_blob = pickle.dumps(face_resized)
+        face_blob = encode_template(face_resized)
         conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name, roll_number, department, face_image IS NOT NULL FROM students WHERE id = %s",
+            (student_id,)
+        )
+        student_data = cursor.fetchone()
+        if not student_data:
+            cursor.close()
+            conn.close()
+            return jsonify({'success': False, 'message': 'Student not found'})
+
+        name, roll, dept, had_face = student_data
+        shard = shards.shard(dept)
+        fingerprint_before = shard.current_fingerprint()
         cursor.execute("UPDATE students SET face_image = %s WHERE id = %s", (face_blob, student_id))
         conn.commit()
         cursor.close()
         conn.close()
 
+        shard.sync_gallery(int(student_id), face=face_resized)
+        with metrics.stage('model_update'):
+            shard.update(int(student_id), face_resized, {'name': name, 'roll': roll, 'dept': dept},
+                         fingerprint_before, replaced=bool(had_face))
+            refresh_workers(shard)
+
         return jsonify({'success': True, 'message': 'Face captured'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
+def face_crops(image, faces):
+    return [image.crop(box) for box in faces]
+
+
+def get_template_histograms(cursor, student_id, updated_at):
+    with template_histograms_lock:
+        cached = template_histograms.get(student_id)
+        if cached is not None and cached[0] == updated_at:
+            template_histograms.move_to_end(student_id)
+            return cached[1]
+
+    cursor.execute("SELECT face_image FROM students WHERE id = %s", (student_id,))
+    row = cursor.fetchone()
+    if not row or row[0] is None:
+        return None
+    histograms = face_histogram(decode_template(row[0]))[None, :]
+
+    with template_histograms_lock:
+        template_histograms[student_id] = (updated_at, histograms)
+        template_histograms.move_to_end(student_id)
+        while len(template_histograms) > VERIFY_CACHE_SIZE:
+            template_histograms.popitem(last=False)
+    return histograms
+
+
+def verify_faces(cursor, student_id, updated_at, crops):
+    # 1:1 check of every detected face against only the claimed student's templates.
+    templates = get_template_histograms(cursor, student_id, updated_at)
+    if templates is None:
+        return None
+    probes = np.stack([face_histogram(crop) for crop in crops])
+    return float(chi_square_distances(probes, templates).min())
+
+
+def request_department(data):
+    # The department shard to search: the request's, else this kiosk's, else None for all shards.
+    return data.get('department') or KIOSK_DEPARTMENT
+
+
+def recognize_faces(crops, department=None):
+    # 1:N search of every crop in one pass; None if nothing is enrolled.
+    return shards.recognize(crops, department)
+
+
+def closest_match(results):
+    # Returns the closest (student_id, confidence, info) over all detected faces.
+    if not results:
+        return None, None, None
+    return min(results, key=lambda r: r[1])
+
+
+def refresh_workers(shard):
+    # Retrains a changed shard here once so the recognition workers only load its new snapshot.
+    if recognition_pool is None:
+        return
+    with shard.lock:
+        shard.load()
+    recognition_pool.reload(shard.department)
+
+
+def detect_request(item):
+    # Runs on a detect_pool thread; each thread has its own cascade.
+    image_bytes, _, _, timings, group = item
+    try:
+        with metrics.stage('decode', timings):
+            image = EncodedImage(image_bytes, DECODE_REDUCTION)
+        with metrics.stage('detect', timings):
+            detector = local_detector(overrides=GROUP_SETTINGS) if group else local_detector()
+            return face_crops(image, detector.detect(image.gray))
+    except Exception as e:
+        return e
+
+
+def process_recognition_batch(requests):
+    # requests are (image_bytes, department, search, timings, group); each gets (crops, results),
+    # with results None unless searched. group photos use the group detector settings. Stage times go into each request's timings dict.
+    if recognition_pool is None:
+        return detect_and_score(requests)
+    # The workers decode, detect and crop exactly as detect_and_score does; images too large for
+    # their shared-memory slots, or with more faces than a slot holds, are still handled here.
+    output = recognition_pool.recognize(requests)
+    local = [i for i, result in enumerate(output) if result is None]
+    if local:
+        for i, result in zip(local, detect_and_score([requests[i] for i in local])):
+            output[i] = result
+    return output
+
+
+def detect_and_score(requests):
+    # Images are decoded and detected in parallel, then the crops of all searching requests for a
+    # department are scored in a single recognize call.
+    detected = list(detect_pool.map(detect_request, requests))
+    groups = {}
+    for i, (_, department, search, _, _) in enumerate(requests):
+        if search and isinstance(detected[i], list) and detected[i]:
+            groups.setdefault(department, []).append(i)
+
+    results = [None] * len(requests)
+    for department, indices in groups.items():
+        started = time.perf_counter()
+        try:
+            scored = recognize_faces([crop for i in indices for crop in detected[i]], department)
+        except Exception as e:
+            for i in indices:
+                detected[i] = e
+            continue
+        elapsed = time.perf_counter() - started
+        start = 0
+        for i in indices:
+            end = start + len(detected[i])
+            results[i] = scored[start:end] if scored is not None else None
+            metrics.add_time(requests[i][3], 'predict', elapsed)
+            start = end
+    return [found if isinstance(found, Exception) else (found, results[i]) for i, found in enumerate(detected)]
+
+
+detect_pool = ThreadPoolExecutor(max_workers=max(1, BATCH_WORKERS), thread_name_prefix='detect')
+recognition_batcher = RequestBatcher(process_recognition_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000.0)
+
+
+def recognize_request(image_bytes, department, search, group=False):
+    # (crops, results) for this request's image from the micro-batcher. Time spent in the batcher
+    # other than decoding, detecting and predicting is recorded as 'batch_wait'.
+    timings = metrics.current_timings()
+    started = time.perf_counter()
+    crops, results = recognition_batcher.submit((image_bytes, department, search, timings, group))
+    if timings is not None:
+        busy = sum(timings.get(stage_name, 0.0) for stage_name in ('decode', 'detect', 'predict'))
+        metrics.add_time(timings, 'batch_wait', max(0.0, time.perf_counter() - started - busy))
+    metrics.inc('face_faces_detected_total', len(crops), endpoint=request.endpoint)
+    return crops, results
+
+
+def count_recognition(result, amount=1):
+    # result is 'accepted', 'rejected' (too far from the closest match) or 'no match'.
+    metrics.inc('face_recognitions_total', amount, endpoint=request.endpoint, result=result)
+
+
+def already_marked(cursor, roll_number):
+    if roll_number in marked_today or get_writer().is_pending(roll_number):
+        return True
+    # Another process may have marked them since the set was built.
+    cursor.execute(
+        "SELECT id FROM attendance_log WHERE roll_number = %s AND attend_date = CURDATE()",
+        (roll_number,)
+    )
+    if cursor.fetchone() is None:
+        return False
+    marked_today.add(roll_number)
+    return True
+
+
 @app.route('/api/mark_attendance', methods=['POST'])
+@admission_required
 def mark_attendance():
     try:
-        data = request.json
+        data = request_data()
         roll_number = data.get('roll_number')
-        image_data = data.get('image_data')
+        image_bytes = request_image_bytes(data)
 
-        if not roll_number or not image_data:
+        if image_bytes is None:
             return jsonify({'success': False, 'message': 'Missing data'})
 
-        success, label_map = train_recognizer()
-        if not success:
-            return jsonify({'success': False, 'message': 'No registered faces'})
-
-        image_data = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        faces = face_cascade.detectMultiScale(gray, 1.1, 5)
-        if not len(faces):
+        # A claimed roll number is verified 1:1 below, so only unclaimed faces join the batched search.
+        crops, results = recognize_request(image_bytes, request_department(data), not roll_number)
+        if not crops:
             return jsonify({'success': False, 'message': 'No face detected'})
 
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id, name, department FROM students WHERE roll_number = %s", (roll_number,))
-        student_data = cursor.fetchone()
 
-        if not student_data:
-            cursor.close()
-            conn.close()
-            return jsonify({'success': False, 'message': 'Student not found'})
+        if roll_number:
+            cursor.execute(
+                "SELECT id, name, department, updated_at FROM students WHERE roll_number = %s", (roll_number,))
+            student_data = cursor.fetchone()
 
-        student_id, name, dept = student_data
+            if not student_data:
+                cursor.close()
+                conn.close()
+                return jsonify({'success': False, 'message': 'Student not found'})
 
-        cursor.execute(
-            "SELECT id FROM attendance_log WHERE roll_number = %s AND DATE(timestamp) = CURDATE()",
-            (roll_number,)
-        )
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({'success': False, 'message': 'Attendance already marked'})
+            student_id, name, dept, updated_at = student_data
 
-        for (x, y, w, h) in faces:
-            face_crop = gray[y:y + h, x:x + w]
-            face_resized = cv2.resize(face_crop, (200, 200))
+            if already_marked(cursor, roll_number):
+                cursor.close()
+                conn.close()
+                return jsonify({'success': False, 'message': 'Attendance already marked'})
 
-            predicted_id, confidence = recognizer.predict(face_resized)
+            with metrics.stage('verify'):
+                confidence = verify_faces(cursor, student_id, updated_at, crops)
+            if confidence is None:
+                cursor.close()
+                conn.close()
+                count_recognition('no match')
+                return jsonify({'success': False, 'message': 'No face registered for this student'})
+        else:
+            student_id, confidence, info = closest_match(results)
+            if student_id is None:
+                cursor.close()
+                conn.close()
+                count_recognition('no match')
+                return jsonify({'success': False, 'message': 'No registered faces'})
 
-            if predicted_id == student_id and confidence < 70:
-                cursor.execute(
-                    "INSERT INTO attendance_log (roll_number, name, department) VALUES (%s, %s, %s)",
-                    (roll_number, name, dept)
-                )
-                conn.commit()
+            if info is None or confidence >= CONFIDENCE_THRESHOLD:
                 cursor.close()
                 conn.close()
+                count_recognition('rejected')
+                return jsonify({'success': False, 'message': 'Face not recognized'})
 
-                return jsonify({'success': True, 'message': f'Attendance marked for {name}', 'confidence': float(confidence)})
+            name, roll_number, dept = info['name'], info['roll'], info['dept']
+            if already_marked(cursor, roll_number):
+                cursor.close()
+                conn.close()
+                return jsonify({'success': False, 'message': f'Attendance already marked for {name}'})
 
         cursor.close()
         conn.close()
+
+        if confidence < CONFIDENCE_THRESHOLD:
+            count_recognition('accepted')
+            get_writer().submit(roll_number, name, dept)
+            marked_today.add(roll_number)
+            return jsonify({'success': True, 'message': f'Attendance marked for {name}', 'confidence': confidence})
+
+        count_recognition('rejected')
         return jsonify({'success': False, 'message': 'Face not recognized'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
+@app.route('/api/mark_attendance_group', methods=['POST'])
+@admission_required
+def mark_attendance_group():
+    try:
+        data = request_data()
+        image_bytes = request_image_bytes(data)
+
+        if image_bytes is None:
+            return jsonify({'success': False, 'message': 'Missing data'})
+
+        crops, results = recognize_request(image_bytes, request_department(data), True, group=True)
+        if not crops:
+            return jsonify({'success': False, 'message': 'No face detected'})
+
+        if results is None:
+            count_recognition('no match', len(crops))
+            return jsonify({'success': False, 'message': 'No registered faces'})
+
+        # Best match per student; a face that matches nobody well enough is just counted.
+        recognized, unrecognized = {}, 0
+        for student_id, confidence, info in results:
+            if info is None or confidence >= CONFIDENCE_THRESHOLD:
+                unrecognized += 1
+            elif student_id not in recognized or confidence < recognized[student_id][0]:
+                recognized[student_id] = (confidence, info)
+        count_recognition('accepted', len(results) - unrecognized)
+        count_recognition('rejected', unrecognized)
+
+        marked, skipped = [], []
+        if recognized:
+            writer = get_writer()
+            already = {info['roll'] for _, info in recognized.values()
+                       if info['roll'] in marked_today or writer.is_pending(info['roll'])}
+            rolls = [info['roll'] for _, info in recognized.values() if info['roll'] not in already]
+            if rolls:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                placeholders = ', '.join(['%s'] * len(rolls))
+                cursor.execute(
+                    "SELECT roll_number FROM attendance_log "
+                    f"WHERE attend_date = CURDATE() AND roll_number IN ({placeholders})",
+                    rolls
+                )
+                found = {row[0] for row in cursor.fetchall()}
+                cursor.close()
+                conn.close()
+                marked_today.update(found)
+                already |= found
+
+            rows = []
+            for confidence, info in recognized.values():
+                entry = {'roll': info['roll'], 'name': info['name'], 'department': info['dept'],
+                         'confidence': confidence}
+                if info['roll'] in already:
+                    skipped.append(entry)
+                else:
+                    marked.append(entry)
+                    rows.append((info['roll'], info['name'], info['dept']))
+
+            if rows:
+                writer.submit_many(rows)
+                marked_today.update(row[0] for row in rows)
+
+        return jsonify({
+            'success': True,
+            'message': f'Attendance marked for {len(marked)} student(s)',
+            'faces_detected': len(results),
+            'marked': marked,
+            'already_marked': skipped,
+            'unrecognized': unrecognized
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+
 @app.route('/api/admin_login', methods=['POST'])
 def admin_login():
     try:
@@ -290,7 +580,7 @@ def get_attendance_log():
         cursor = conn.cursor()
         cursor.execute(
             "SELECT roll_number, name, department, timestamp FROM attendance_log "
-            "WHERE DATE(timestamp) = CURDATE() ORDER BY timestamp DESC"
+            "WHERE attend_date = CURDATE() ORDER BY timestamp DESC"
         )
         rows = cursor.fetchall()
         cursor.close()
@@ -315,7 +605,7 @@ def get_stats():
         cursor.execute("SELECT COUNT(*) FROM students")
         total_students = cursor.fetchone()[0]
 
-        cursor.execute("SELECT COUNT(*) FROM attendance_log WHERE DATE(timestamp) = CURDATE()")
+        cursor.execute("SELECT COUNT(*) FROM attendance_log WHERE attend_date = CURDATE()")
         today_attendance = cursor.fetchone()[0]
 
         cursor.execute("SELECT COUNT(DISTINCT department) FROM students")
@@ -336,8 +626,100 @@ def get_stats():
         return jsonify({'success': False, 'message': str(e)})
 
 
+@app.route('/api/db_pool')
+def get_db_pool():
+    return jsonify({'success': True, 'pool': pool_stats()})
+
+
+@app.route('/api/batching')
+def get_batching():
+    return jsonify({'success': True, 'batching': recognition_batcher.stats()})
+
+
+@app.route('/api/admission')
+def get_admission():
+    return jsonify({'success': True, 'admission': admission.stats()})
+
+
+@app.route('/api/recognition_workers')
+def get_recognition_workers():
+    if recognition_pool is None:
+        return jsonify({'success': False, 'message': 'Recognition runs in the server process'})
+    return jsonify({'success': True, 'workers': recognition_pool.stats()})
+
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def shard_students():
+    return [({'department': shard.department}, len(shard.label_map)) for shard in list(shards.shards.values())]
+
+
+def worker_stat(key):
+    return lambda: recognition_pool.stats()[key] if recognition_pool is not None else []
+
+
+metrics.collect('face_model_students', 'gauge', "Students in each loaded recognizer shard.", shard_students)
+metrics.collect('face_admission_in_flight', 'gauge', "Recognition requests running.",
+                lambda: admission.stats()['in_flight'])
+metrics.collect('face_admission_queued', 'gauge', "Recognition requests waiting for admission.",
+                lambda: admission.stats()['queued'])
+metrics.collect('face_admission_rejected_total', 'counter', "Requests turned away by admission control, by reason.",
+                lambda: [({'reason': reason}, count) for reason, count in admission.stats()['rejected'].items()])
+metrics.collect('face_batch_pending', 'gauge', "Requests waiting for the next recognition batch.",
+                lambda: recognition_batcher.stats()['pending'])
+metrics.collect('face_batches_total', 'counter', "Recognition batches processed.",
+                lambda: recognition_batcher.stats()['batches'])
+metrics.collect('face_db_pool_in_use', 'gauge', "Pooled database connections checked out.",
+                lambda: pool_stats()['in_use'])
+metrics.collect('face_db_pool_timeouts_total', 'counter', "Waits for a pooled connection that timed out.",
+                lambda: pool_stats()['timeouts'])
+metrics.collect('face_recognition_workers_alive', 'gauge', "Recognition worker processes running.",
+                worker_stat('alive'))
+metrics.collect('face_recognition_worker_restarts_total', 'counter', "Recognition worker processes restarted.",
+                worker_stat('restarts'))
+
+
+def start_recognition_workers():
+    global recognition_pool
+    pool = RecognitionPool(RECOGNITION_PROCESSES)
+    atexit.register(pool.stop)
+    ready = pool.start()
+    print(f"{ready} of {pool.size} recognition worker process(es) ready.")
+    recognition_pool = pool
+
+
+def initialize_recognizer():
+    try:
+        conn = get_db_connection()
+        schema.migrate(conn)
+        conn.close()
+    except Exception as e:
+        print(f"Schema migration error: {e}")
+    if KIOSK_DEPARTMENT:
+        shard = shards.shard(KIOSK_DEPARTMENT)
+        with shard.lock:
+            shard.load()
+    else:
+        try:
+            print(f"Loaded {shards.load_all()} recognizer shard(s).")
+        except Exception as e:
+            print(f"Recognizer error: {e}")
+    if RECOGNITION_PROCESSES > 0:
+        # After the shards above, so the workers load snapshots instead of each training.
+        start_recognition_workers()
+    get_writer()
+    try:
+        print(f"{marked_today.refresh()} student(s) already marked today.")
+    except Exception as e:
+        print(f"Could not load today's attendance: {e}")
+
+
 if __name__ == '__main__':
     if initialize_face_detection():
+        initialize_recognizer()
         print("Starting Flask server...")
         app.run(debug=True, host='0.0.0.0', port=5000)
     else:
@@ -1,94 +1,99 @@
 import cv2
-import pickle
-import mysql.connector
-import numpy as np
 from datetime import datetime
 
-face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
-
-def get_db_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',
-        database='face_attendance'
-    )
-
-def load_faces_from_db():
+import schema
+from attendance_writer import get_writer
+from config import CONFIDENCE_THRESHOLD, KIOSK_DEPARTMENT
+from db import get_db_connection
+from face_detect import local_detector
+from frame_gate import MotionGate, QualityGate
+from face_template import TEMPLATE_SIZE
+from face_tracker import FaceTracker
+from marked_today import marked_today
+from recognizer_shards import ShardedRecognizer
+from video_pipeline import VideoPipeline
+
+shards = ShardedRecognizer()
+
+def find_student(roll):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name, roll_number, department, face_image FROM students")
-    rows = cursor.fetchall()
+    cursor.execute("SELECT id, department FROM students WHERE roll_number = %s", (roll,))
+    row = cursor.fetchone()
     cursor.close()
     conn.close()
+    return row
 
-    faces = []
-    labels = []
-    label_map = {}
-    roll_to_id = {}
-
-    for row in rows:
-        student_id, name, roll, dept, face_blob = row
-        if face_blob is None:
-            print(f" Skipping student '{name}' (Roll: {roll}) - no face image found.")
-            continue
-        face = pickle.loads(face_blob)
-        faces.append(face)
-        labels.append(student_id)
-        label_map[student_id] = (name, roll, dept)
-        roll_to_id[roll] = student_id
-
-    return faces, labels, label_map, roll_to_id
-
-marked_ids = set()
+def load_recognizer(department):
+    # Only the student's department shard is loaded, from its snapshot or trained on first use.
+    shard = shards.shard(department)
+    with shard.lock:
+        return shard.get()
 
 def mark_attendance(student_id, label_map):
-    if student_id in marked_ids:
+    student = label_map[student_id]
+    name, roll, dept = student['name'], student['roll'], student['dept']
+    if roll in marked_today or get_writer().is_pending(roll):
         return
 
-    name, roll, dept = label_map[student_id]
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO attendance_log (roll_number, name, department) VALUES (%s, %s, %s)",
-        (roll, name, dept)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    get_writer().submit(roll, name, dept)
 
-    marked_ids.add(student_id)
+    marked_today.add(roll)
     print(f" Attendance marked: {name} ({roll}) - {dept} at {datetime.now().strftime('%H:%M:%S')}")
 
+def detect_faces(gray):
+    return local_detector().detect(gray)
+
+def recognize_face(gray, box, recognizer, quality):
+    # (student_id, confidence) for one tracked face, with student_id None on error, or None
+    # when the crop is too blurry or badly exposed to be worth a prediction.
+    x, y, w, h = box
+    face_crop = cv2.resize(gray[y:y + h, x:x + w], TEMPLATE_SIZE)
+    if quality.problem(face_crop):
+        return None
+    try:
+        return recognizer.predict(face_crop)
+    except Exception as e:
+        print(f" Recognition error: {e}")
+        return None, None
+
 def mark_single_student(user_id, label_map, recognizer):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    # Each face is recognized once when it is first tracked; faces that are not this student
+    # are retried every few frames in case the first look was poor.
+    # Static frames skip detection entirely and poor crops skip recognition.
+    motion, quality = MotionGate(), QualityGate()
+    tracker = FaceTracker(detect_faces, lambda gray, box: recognize_face(gray, box, recognizer, quality),
+                          accepts=lambda identity: identity[0] == user_id and identity[1] < CONFIDENCE_THRESHOLD,
+                          motion=motion)
+    pipeline = VideoPipeline(lambda frame: tracker.update(frame.gray, frame.index))
+    if not pipeline.start():
         print(" Webcam not found")
         return False
 
     print(" Camera is on. Look at the camera. Press 'q' to stop this session.\n")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print(" Failed to read from webcam")
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces_rects = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-
-        found_user = False
-
-        for (x, y, w, h) in faces_rects:
-            face_crop = gray[y:y + h, x:x + w]
-
-            try:
-                student_id, confidence = recognizer.predict(face_crop)
-
-                if student_id == user_id and confidence < 70:
-                    name, roll, dept = label_map[student_id]
+    found_user = False
+    with pipeline:
+        for captured in pipeline.frames():
+            frame = captured.image
+
+            for track_id, (x, y, w, h), identity in captured.result or []:
+                if identity is None:
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 200, 255), 2)
+                    cv2.putText(frame, "Hold still", (x, y - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 200, 255), 2)
+                    continue
+
+                student_id, confidence = identity
+                if student_id is None:
+                    cv2.putText(frame, "Recognition Error", (x, y - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+                    continue
+
+                if student_id == user_id and confidence < CONFIDENCE_THRESHOLD:
                     mark_attendance(student_id, label_map)
-                    label_text = f"{name}  ({int(confidence)})"
+                    label_text = f"{label_map[student_id]['name']}  ({int(confidence)})"
                     color = (0, 255, 0)  # Green
                     found_user = True
                 else:
@@ -98,52 +103,62 @@ def mark_single_student(user_id, label_map, recognizer):
                 cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
                 cv2.putText(frame, label_text, (x, y - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-            except Exception as e:
-                cv2.putText(frame, "Recognition Error", (x, y - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
-                print(f" Recognition error: {e}")
 
-        cv2.imshow('Attendance', frame)
-        key = cv2.waitKey(1) & 0xFF
+            pipeline.draw_stats(frame)
+            cv2.imshow('Attendance', frame)
+            key = cv2.waitKey(1) & 0xFF
 
-        if found_user:
-            print(" Face recognized and attendance marked.")
-            break
+            if found_user:
+                print(" Face recognized and attendance marked.")
+                break
 
-        if key == ord('q'):
-            print("\n Stopping this attendance session.")
-            break
+            if key == ord('q'):
+                print("\n Stopping this attendance session.")
+                break
+
+        if pipeline.read_failed and not found_user:
+            print(" Failed to read from webcam")
+    print(f" Tracking: {tracker.stats_text()}")
+    print(f" Gating: {motion.stats_text()}, {quality.stats_text()}")
 
-    cap.release()
     cv2.destroyAllWindows()
     return found_user
 
 def start_attendance():
     print("\n Starting Attendance System\n")
 
-    faces, labels, label_map, roll_to_id = load_faces_from_db()
-    if not faces:
-        print(" No registered faces found. Please register students with face images first.")
-        return
-
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.train(faces, np.array(labels))
+    conn = get_db_connection()
+    schema.migrate(conn)
+    conn.close()
+    get_writer()
+    marked_today.refresh()
+    if KIOSK_DEPARTMENT:
+        load_recognizer(KIOSK_DEPARTMENT)
 
     while True:
         user_roll = input("\nEnter roll number to mark attendance or type 'exit' to quit: ").strip()
 
         if user_roll.lower() == 'exit':
             print(" Exiting Attendance System.")
+            get_writer().stop()
             break
 
-        if user_roll not in roll_to_id:
+        student = find_student(user_roll)
+        if student is None:
             print(f" Roll number '{user_roll}' not found in database. Try again.")
             continue
 
-        user_id = roll_to_id[user_roll]
+        if user_roll in marked_today:
+            print(f" Attendance already marked today for roll number '{user_roll}'.")
+            continue
+
+        user_id, department = student
+        recognizer, label_map = load_recognizer(department)
+        if recognizer is None or user_id not in label_map:
+            print(f" No face image registered for roll number '{user_roll}'. Try again.")
+            continue
 
-        print(f"\nPlease look at the camera, {label_map[user_id][0]} (Roll: {user_roll})")
+        print(f"\nPlease look at the camera, {label_map[user_id]['name']} (Roll: {user_roll})")
 
         marked = mark_single_student(user_id, label_map, recognizer)
 
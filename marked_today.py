@@ -0,0 +1,59 @@
+import threading
+from datetime import date
+
+from db import get_db_connection
+
+
+class MarkedToday:
+    # Roll numbers already marked today, shared by every request thread in the process. Built
+    # from the database on first use and again whenever the date changes, so repeat submissions
+    # are rejected without a query.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._rolls = set()
+
+    def _load(self, today):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT roll_number FROM attendance_log WHERE attend_date = %s", (today,))
+        rolls = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+        return rolls
+
+    def _current(self):
+        today = date.today()
+        if self._day != today:
+            rolls = self._load(today)
+            with self._lock:
+                if self._day != today:
+                    self._day, self._rolls = today, rolls
+        return self._rolls
+
+    def refresh(self):
+        today = date.today()
+        rolls = self._load(today)
+        with self._lock:
+            self._day, self._rolls = today, rolls
+        return len(rolls)
+
+    def __contains__(self, roll_number):
+        return roll_number in self._current()
+
+    def add(self, roll_number):
+        rolls = self._current()
+        with self._lock:
+            rolls.add(roll_number)
+
+    def update(self, roll_numbers):
+        rolls = self._current()
+        with self._lock:
+            rolls.update(roll_numbers)
+
+    def __len__(self):
+        return len(self._current())
+
+
+marked_today = MarkedToday()
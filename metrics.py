@@ -0,0 +1,168 @@
+import bisect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, METRICS_LOG
+
+# Latency buckets in seconds, 1 ms to 10 s.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+_described = {}
+_counters = {}
+_histograms = {}
+_collectors = []
+
+
+def describe(name, kind, text):
+    _described[name] = (kind, text)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # Per-bucket counts (the last one is +Inf), then sum and count.
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+def collect(name, kind, text, fn):
+    # Registers a metric read when /metrics is scraped; fn returns a number or [(labels, value)].
+    describe(name, kind, text)
+    _collectors.append((name, fn))
+
+
+# Stage timings of the request being served by this thread. Work done for it on other threads
+# (batch decode/detect/predict) adds to the same dict, which is passed along with the work.
+
+def begin_request():
+    if METRICS_ENABLED:
+        _local.timings = {}
+        _local.started = time.perf_counter()
+
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+
+def add_time(timings, stage_name, seconds):
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+@contextmanager
+def stage(stage_name, timings=None):
+    # Times the block into the given timings, else the current request's (if any).
+    if not METRICS_ENABLED:
+        yield
+        return
+    timings = timings if timings is not None else current_timings()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(timings, stage_name, time.perf_counter() - start)
+
+
+def end_request(endpoint, method, status):
+    timings = current_timings()
+    if timings is None:
+        return
+    _local.timings = None
+    elapsed = time.perf_counter() - _local.started
+    observe('face_request_seconds', elapsed, endpoint=endpoint, status=status)
+    for stage_name, seconds in timings.items():
+        observe('face_stage_seconds', seconds, endpoint=endpoint, stage=stage_name)
+    if METRICS_LOG:
+        line = json.dumps({'ts': round(time.time(), 3), 'endpoint': endpoint, 'method': method, 'status': status,
+                           'ms': round(1000 * elapsed, 2),
+                           'stages': {k: round(1000 * v, 2) for k, v in timings.items()}})
+        with _log_lock:
+            if METRICS_LOG == '-':
+                print(line, file=sys.stdout, flush=True)
+            else:
+                with open(METRICS_LOG, 'a') as f:
+                    f.write(line + '\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _header(lines, seen, name):
+    if name in seen:
+        return
+    seen.add(name)
+    kind, text = _described.get(name, ('untyped', ''))
+    if text:
+        lines.append(f"# HELP {name} {text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render():
+    # Everything in the Prometheus text exposition format.
+    lines, seen = [], set()
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+
+    for (name, labels), value in counters:
+        _header(lines, seen, name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+    for (name, labels), values in histograms:
+        _header(lines, seen, name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), values):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{name}_bucket{_labels(labels, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {values[-2]:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {values[-1]}")
+
+    for name, fn in _collectors:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        _header(lines, seen, name)
+        samples = value if isinstance(value, list) else [({}, value)]
+        for labels, sample in samples:
+            lines.append(f"{name}{_labels(sorted(labels.items()))} {float(sample)!r}")
+    return '\n'.join(lines) + '\n'
+
+
+describe('face_request_seconds', 'histogram', "Time to serve a request, by endpoint and HTTP status.")
+describe('face_stage_seconds', 'histogram', "Time a request spent in each stage (read, admission, decode, detect, "
+                                            "predict, verify, db_connect, db, ...).")
+describe('face_faces_detected_total', 'counter', "Faces detected in uploaded images.")
+describe('face_recognitions_total', 'counter', "Recognition decisions, by result.")
+describe('face_db_errors_total', 'counter', "Failed database operations.")
+describe('face_model_train_seconds', 'histogram', "Time to train a recognizer shard from the database.")
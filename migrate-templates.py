@@ -0,0 +1,51 @@
+import pickle
+import sys
+
+from db import get_db_connection
+from face_template import encode_template, is_template
+
+BATCH_SIZE = 500
+
+def migrate_templates(batch_size=BATCH_SIZE):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    last_id = 0
+    converted = skipped = failed = 0
+    while True:
+        cursor.execute(
+            "SELECT id, face_image FROM students WHERE id > %s AND face_image IS NOT NULL ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for student_id, face_blob in rows:
+            if is_template(face_blob):
+                skipped += 1
+                continue
+            try:
+                # The only remaining pickle.loads: trusted legacy rows being rewritten once.
+                face = pickle.loads(face_blob)
+                updates.append((encode_template(face), student_id))
+            except Exception as e:
+                print(f" Student ID {student_id}: could not convert face image ({e})")
+                failed += 1
+
+        if updates:
+            cursor.executemany("UPDATE students SET face_image = %s WHERE id = %s", updates)
+            conn.commit()
+            converted += len(updates)
+        print(f" Processed up to ID {last_id}: {converted} converted, {skipped} already migrated, {failed} failed")
+
+    cursor.close()
+    conn.close()
+    print(f"\n Migration complete: {converted} converted, {skipped} already migrated, {failed} failed.")
+    return failed == 0
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE
+    sys.exit(0 if migrate_templates(size) else 1)
@@ -0,0 +1,129 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from config import MODEL_DIR, RECOGNIZER_BACKEND
+from lbp_matcher import create_recognizer
+
+META_FILE = 'lbph_model.json'
+KEEP_MODELS = 2
+
+
+def gallery_fingerprint(conn, department=None):
+    # department=None fingerprints every student; otherwise only that department's shard.
+    query = ("SELECT COUNT(*), COALESCE(MAX(updated_at), ''), "
+             "COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', id, name, roll_number, department, updated_at))), 0) "
+             "FROM students WHERE face_image IS NOT NULL")
+    params = ()
+    if department is not None:
+        query += " AND COALESCE(department, '') = %s"
+        params = (department,)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    cursor.close()
+    return hashlib.sha1('|'.join(str(v) for v in row).encode()).hexdigest()
+
+
+def snapshot_stamp(model_dir=MODEL_DIR):
+    try:
+        return os.stat(os.path.join(model_dir, META_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_meta(model_dir=MODEL_DIR):
+    try:
+        with open(os.path.join(model_dir, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(recognizer, label_map, fingerprint, model_dir=MODEL_DIR, backend=RECOGNIZER_BACKEND):
+    os.makedirs(model_dir, exist_ok=True)
+    extension = getattr(recognizer, 'FILE_EXTENSION', '.yml.gz')
+    model_file = f"lbph_{int(time.time() * 1000)}_{fingerprint[:12]}{extension}"
+    tmp_model = os.path.join(model_dir, 'tmp_' + model_file)
+    recognizer.write(tmp_model)
+    os.replace(tmp_model, os.path.join(model_dir, model_file))
+
+    meta = {
+        'fingerprint': fingerprint,
+        'backend': backend,
+        'model_file': model_file,
+        'created': time.time(),
+        'labels': {str(k): v for k, v in label_map.items()},
+    }
+    tmp_meta = os.path.join(model_dir, META_FILE + '.tmp')
+    with open(tmp_meta, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, os.path.join(model_dir, META_FILE))
+
+    # Keep the previous model around so a reader racing this swap can still open it.
+    models = sorted(glob.glob(os.path.join(model_dir, 'lbph_*')))
+    for path in models[:-KEEP_MODELS]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return snapshot_stamp(model_dir)
+
+
+def load_snapshot(model_dir=MODEL_DIR, backend=RECOGNIZER_BACKEND):
+    meta = read_meta(model_dir)
+    if not meta or meta.get('backend', 'lbph') != backend:
+        return None
+    try:
+        recognizer = create_recognizer(backend)
+        recognizer.read(os.path.join(model_dir, meta['model_file']))
+    except Exception as e:
+        print(f"Could not read model snapshot: {e}")
+        return None
+    label_map = {int(k): v for k, v in meta['labels'].items()}
+    return recognizer, label_map, meta['fingerprint']
+
+
+def load_or_train(fingerprint, train, model_dir=MODEL_DIR):
+    snapshot = load_snapshot(model_dir)
+    if snapshot is not None and snapshot[2] == fingerprint:
+        print(f"Loaded model snapshot ({len(snapshot[1])} students).")
+        return snapshot[0], snapshot[1]
+
+    recognizer, label_map = train()
+    if recognizer is not None:
+        save_snapshot(recognizer, label_map, fingerprint, model_dir)
+    return recognizer, label_map
+
+
+def update_snapshot(fingerprint_before, fingerprint_after, student_id, face=None, info=None, deleted=False,
+                    model_dir=MODEL_DIR):
+    # Applies one enrollment change to the current snapshot so other processes can switch to it
+    # instead of retraining. Skipped when the snapshot was already stale before the change, when
+    # the change needs remove() and the backend has none (LBPH), or when an ANN index has grown
+    # enough to need its partitions refitted.
+    snapshot = load_snapshot(model_dir)
+    if snapshot is None or snapshot[2] != fingerprint_before:
+        return False
+    recognizer, label_map, _ = snapshot
+
+    if deleted or (face is not None and student_id in label_map):
+        if not hasattr(recognizer, 'remove'):
+            return False
+        recognizer.remove(student_id)
+        label_map.pop(student_id, None)
+    if face is not None:
+        recognizer.update([face], np.array([student_id]))
+        if getattr(recognizer, 'needs_refit', lambda: False)():
+            # Left stale, so the next process to load the shard retrains it from the database.
+            return False
+        label_map[student_id] = info
+    elif info is not None and student_id in label_map:
+        label_map[student_id] = info
+
+    save_snapshot(recognizer, label_map, fingerprint_after, model_dir)
+    return True
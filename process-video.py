@@ -0,0 +1,170 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+
+import schema
+from attendance_writer import get_writer
+from config import CONFIDENCE_THRESHOLD, KIOSK_DEPARTMENT
+from db import get_db_connection
+from face_detect import worker_detector
+from face_template import TEMPLATE_SIZE
+from frame_gate import QualityGate
+from recognizer_shards import ShardedRecognizer
+
+# Per worker process, set up by init_worker.
+shards = None
+detector = None
+quality = None
+
+
+def init_worker():
+    global shards, detector, quality
+    shards = ShardedRecognizer()
+    detector = worker_detector()
+    quality = QualityGate()
+
+
+def video_chunks(path, chunk_seconds):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f" Could not open {path}")
+        return []
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    step = max(1, int(round(chunk_seconds * fps)))
+    return [(path, start, min(start + step, frames), fps) for start in range(0, frames, step)]
+
+
+def process_chunk(path, start, end, fps, sample_fps, department):
+    # Sightings in frames [start, end) sampled at sample_fps:
+    # {student_id: [first_seen_seconds, count, best_confidence, info]}.
+    began = time.perf_counter()
+    step = max(1, int(round(fps / sample_fps)))
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    sightings = {}
+    sampled = faces_seen = 0
+    for index in range(start, end):
+        # grab() skips the colour conversion of frames that are not sampled.
+        if (index - start) % step:
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        sampled += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        crops = [cv2.resize(gray[y:y + h, x:x + w], TEMPLATE_SIZE) for (x, y, w, h) in detector.detect(gray)]
+        crops = [crop for crop in crops if not quality.problem(crop)]
+        faces_seen += len(crops)
+        if not crops:
+            continue
+        for student_id, confidence, info in shards.recognize(crops, department) or []:
+            if info is None or confidence >= CONFIDENCE_THRESHOLD:
+                continue
+            seen = sightings.get(student_id)
+            if seen is None:
+                sightings[student_id] = [index / fps, 1, confidence, info]
+            else:
+                seen[1] += 1
+                seen[2] = min(seen[2], confidence)
+    cap.release()
+    return sightings, sampled, faces_seen, (end - start) / fps, time.perf_counter() - began
+
+
+def merge_sightings(total, sightings):
+    for student_id, (first_seen, count, confidence, info) in sightings.items():
+        seen = total.get(student_id)
+        if seen is None:
+            total[student_id] = [first_seen, count, confidence, info]
+        else:
+            seen[0] = min(seen[0], first_seen)
+            seen[1] += count
+            seen[2] = min(seen[2], confidence)
+
+
+def format_offset(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def run(args):
+    conn = get_db_connection()
+    schema.migrate(conn)
+    conn.close()
+    # Train or refresh snapshots once here so the workers only load them.
+    parent = ShardedRecognizer()
+    if args.department:
+        shard = parent.shard(args.department)
+        with shard.lock:
+            shard.load()
+    else:
+        parent.load_all()
+
+    chunks = [chunk for path in args.videos for chunk in video_chunks(path, args.chunk_seconds)]
+    if not chunks:
+        print(" Nothing to process.")
+        return
+    print(f" {len(args.videos)} video(s) in {len(chunks)} chunk(s) of {args.chunk_seconds:.0f}s, "
+          f"sampling {args.sample_fps} frame(s)/s on {args.workers} process(es)")
+
+    started = time.perf_counter()
+    sightings = {}
+    sampled = faces_seen = 0
+    video_seconds = busy_seconds = 0.0
+    # Spawned, not forked: a forked worker would inherit the pooled MySQL connections opened above
+    # and share their sockets with this process.
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(process_chunk, path, start, end, fps, args.sample_fps, args.department)
+                   for path, start, end, fps in chunks]
+        for done, future in enumerate(as_completed(futures), 1):
+            chunk_sightings, chunk_sampled, chunk_faces, chunk_seconds, chunk_busy = future.result()
+            merge_sightings(sightings, chunk_sightings)
+            sampled += chunk_sampled
+            faces_seen += chunk_faces
+            video_seconds += chunk_seconds
+            busy_seconds += chunk_busy
+            print(f"\r Processed {done}/{len(chunks)} chunk(s)", end='', flush=True)
+    elapsed = time.perf_counter() - started
+    print(f"\n {format_offset(video_seconds)} of video, {sampled} frame(s) sampled, {faces_seen} usable face(s) "
+          f"in {elapsed:.1f}s ({video_seconds / elapsed:.1f}x real time, "
+          f"{busy_seconds / elapsed:.1f} of {args.workers} process(es) busy on average)")
+
+    present = sorted((seen for seen in sightings.values() if seen[1] >= args.min_sightings), key=lambda s: s[0])
+    if not present:
+        print(" No students recognized.")
+        return
+    print(f"\n {'Roll':<12} {'Name':<24} {'First seen':>10} {'Sightings':>9} {'Best':>6}")
+    for first_seen, count, confidence, info in present:
+        print(f" {info['roll']:<12} {info['name'][:24]:<24} {format_offset(first_seen):>10} {count:>9} "
+              f"{confidence:>6.1f}")
+
+    if args.dry_run:
+        print(f"\n Dry run: {len(present)} student(s) not written.")
+        return
+    session = datetime.strptime(args.session_start, '%Y-%m-%d %H:%M') if args.session_start else datetime.now()
+    writer = get_writer()
+    writer.submit_many([(info['roll'], info['name'], info['dept']) for _, _, _, info in present], marked_at=session)
+    writer.stop()
+    # Students already marked that day are ignored by the (roll_number, attend_date) key.
+    print(f"\n Attendance submitted for {len(present)} student(s) on {session:%Y-%m-%d}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mark attendance from recorded video files")
+    parser.add_argument('videos', nargs='+', help="video files of one session")
+    parser.add_argument('--department', default=KIOSK_DEPARTMENT, help="only search this department's students")
+    parser.add_argument('--chunk-seconds', type=float, default=60, help="length of the chunks handed to workers")
+    parser.add_argument('--sample-fps', type=float, default=2, help="frames examined per second of video")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--min-sightings', type=int, default=2, help="sightings needed to count as present")
+    parser.add_argument('--session-start', help="'YYYY-MM-DD HH:MM' the recording started (default: now)")
+    parser.add_argument('--dry-run', action='store_true', help="report sightings without writing attendance")
+    run(parser.parse_args())
@@ -0,0 +1,408 @@
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection, shared_memory
+
+import numpy as np
+
+import metrics
+from config import DECODE_REDUCTION, KIOSK_DEPARTMENT, RECOGNITION_PROCESSES, RECOGNITION_SLOT_MB, RECOGNITION_TIMEOUT
+from face_template import TEMPLATE_SIZE
+from image_decode import EncodedImage
+
+TEMPLATE_SHAPE = (TEMPLATE_SIZE[1], TEMPLATE_SIZE[0])
+TEMPLATE_BYTES = TEMPLATE_SHAPE[0] * TEMPLATE_SHAPE[1]
+# Images a worker can hold at once; a job never carries more.
+SLOTS_PER_WORKER = 4
+# An image leaves at least this many template-sized crops of room in its slot.
+MIN_CROPS = 8
+HEALTH_INTERVAL = 1.0
+# Longest wait before restarting a worker that keeps dying before it is ready.
+MAX_RESTART_DELAY = 30.0
+
+
+def crop_offset(size):
+    # Crops follow the encoded image in its slot, 64-byte aligned.
+    return (size + 63) // 64 * 64
+
+
+def detect_and_recognize(detectors, shards, slots, items):
+    # items are (slot, size, department, search, group), the slot holding `size` bytes of an
+    # encoded image whose faces detectors[group] finds. Images are decoded and cropped with
+    # EncodedImage exactly as in the server process, so probes do not depend on where they were made. Each image's crops are written back into
+    # its slot after it; all crops searched in one department are scored together. Returns
+    # (crop count, results, {stage: seconds}) per item, the item's decoding error, or None when
+    # it has more faces than its slot has room for, so the server handles that image itself.
+    counts, crops, timings = [], [], []
+    for slot, size, _, _, group in items:
+        buf = slots[slot].buf
+        started = time.perf_counter()
+        try:
+            image = EncodedImage(buf[:size], DECODE_REDUCTION)
+        except ValueError as e:
+            # A fresh exception: the original's traceback would keep the slot's buffer exported.
+            counts.append(0)
+            crops.append(ValueError(str(e)))
+            timings.append(None)
+            continue
+        decoded = time.perf_counter()
+        offset = crop_offset(size)
+        room = (len(buf) - offset) // TEMPLATE_BYTES
+        boxes = detectors[group].detect(image.gray)
+        if len(boxes) > room:
+            del image
+            counts.append(0)
+            crops.append(None)
+            timings.append(None)
+            continue
+        out = np.ndarray((len(boxes),) + TEMPLATE_SHAPE, dtype=np.uint8, buffer=buf, offset=offset)
+        for i, box in enumerate(boxes):
+            out[i] = image.crop(box)
+        del image
+        counts.append(len(boxes))
+        crops.append(out)
+        timings.append({'decode': decoded - started, 'detect': time.perf_counter() - decoded})
+
+    groups = {}
+    for i, (_, _, department, search, _) in enumerate(items):
+        if search and counts[i]:
+            groups.setdefault(department, []).append(i)
+    results = [None] * len(items)
+    for department, indices in groups.items():
+        started = time.perf_counter()
+        scored = shards.recognize([crop for i in indices for crop in crops[i]], department)
+        elapsed = time.perf_counter() - started
+        start = 0
+        for i in indices:
+            end = start + counts[i]
+            results[i] = scored[start:end] if scored is not None else None
+            timings[i]['predict'] = elapsed
+            start = end
+    return [crops[i] if timings[i] is None else (counts[i], results[i], timings[i]) for i in range(len(items))]
+
+
+def worker_main(index, slot_names, tasks, results):
+    # results is this worker's own pipe to the parent; killing the worker cannot break another's.
+    # Runs in a spawned process; imports that load models and open connections stay out of the parent.
+    from face_detect import GROUP_SETTINGS, worker_detector
+    from recognizer_shards import ShardedRecognizer
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    detectors = {False: worker_detector(), True: worker_detector(GROUP_SETTINGS)}
+    shards = ShardedRecognizer()
+    try:
+        if KIOSK_DEPARTMENT:
+            shard = shards.shard(KIOSK_DEPARTMENT)
+            with shard.lock:
+                shard.load()
+        else:
+            shards.load_all()
+    except Exception as e:
+        # Shards still load lazily on first use.
+        print(f"Recognition worker {index}: {e}")
+    results.send(('ready', index, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        kind, job_id, payload = task
+        if kind == 'reload':
+            shard = shards.shard(payload)
+            with shard.lock:
+                shard.load()
+            continue
+        try:
+            results.send(('done', job_id, detect_and_recognize(detectors, shards, slots, payload)))
+        except Exception as e:
+            # Exceptions from the database driver do not always pickle.
+            results.send(('done', job_id, RuntimeError(str(e))))
+    for slot in slots:
+        slot.close()
+
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.tasks = None
+        self.ready = False
+        self.jobs = set()
+        self.started = 0.0
+        self.completed = 0
+        self.crashes = 0
+        self.restart_at = 0.0
+
+
+class Job:
+    def __init__(self, job_id, worker, slots, sizes, timings):
+        self.id = job_id
+        self.worker = worker
+        self.slots = slots
+        self.sizes = sizes
+        self.timings = timings
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class RecognitionPool:
+    # Decoding, detection and recognition in `size` worker processes, each with its own cascade
+    # and recognizer shards loaded once. Encoded images go to a worker through shared-memory
+    # slots (the worker writes the face crops back into the same slot), so only slot numbers,
+    # sizes and results are pickled. Each worker sends its results over its own pipe, replaced with
+    # the worker, so a killed worker never leaves a shared channel locked or half-written. A monitor
+    # thread restarts workers that exit or spend more than `timeout` seconds on a job, failing only
+    # that worker's jobs.
+
+    def __init__(self, size=RECOGNITION_PROCESSES, slot_mb=RECOGNITION_SLOT_MB, timeout=RECOGNITION_TIMEOUT):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+                      for _ in range(self.size * SLOTS_PER_WORKER)]
+        self.free = list(range(len(self.slots)))
+        self.slots_cond = threading.Condition()
+        # Result pipes being read, each mapped to its worker and process; a pipe is dropped at its EOF.
+        self.channels = {}
+        self.workers = [Worker(i) for i in range(self.size)]
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.stopped = threading.Event()
+        self.threads = []
+        self.restarts = 0
+        self.failed = 0
+
+    def start(self, wait=60.0):
+        for worker in self.workers:
+            self._spawn(worker)
+        self.threads = [threading.Thread(target=self._read_results, name='recognition-results', daemon=True),
+                        threading.Thread(target=self._monitor, name='recognition-monitor', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline and not all(worker.ready for worker in self.workers):
+            time.sleep(0.1)
+        return sum(worker.ready for worker in self.workers)
+
+    def _spawn(self, worker):
+        worker.tasks = self.context.Queue()
+        worker.ready = False
+        worker.started = time.monotonic()
+        receiver, sender = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(
+            target=worker_main, args=(worker.index, [slot.name for slot in self.slots], worker.tasks, sender),
+            name=f'recognition-{worker.index}', daemon=True)
+        worker.process.start()
+        # Only the worker holds the sending end, so its pipe reads EOF once it exits.
+        sender.close()
+        with self.lock:
+            self.channels[receiver] = (worker, worker.process)
+
+    def _stop_worker(self, worker, reason):
+        if worker.process.is_alive():
+            # SIGKILL: a hung worker may never act on SIGTERM.
+            worker.process.kill()
+        worker.process.join(timeout=5)
+        with self.lock:
+            jobs = [self.jobs.pop(job_id) for job_id in worker.jobs if job_id in self.jobs]
+            worker.jobs.clear()
+            self.restarts += 1
+            self.failed += len(jobs)
+        # The old process is gone, so nothing writes to these slots any more.
+        for job in jobs:
+            self._release(job.slots)
+            job.future.set_exception(RuntimeError(f"Recognition worker {worker.index} {reason}"))
+
+        # Back off while a worker keeps dying before it is ready (e.g. the database is down).
+        worker.crashes = 0 if worker.ready else worker.crashes + 1
+        delay = min(MAX_RESTART_DELAY, 2.0 ** worker.crashes - 1)
+        worker.restart_at = time.monotonic() + delay
+        print(f"Recognition worker {worker.index} {reason}; restarting" + (f" in {delay:.0f}s." if delay else "."))
+        if delay:
+            worker.process, worker.ready = None, False
+        else:
+            self._spawn(worker)
+
+    def _alive(self, worker):
+        return worker.process is not None and worker.process.is_alive()
+
+    def _monitor(self):
+        while not self.stopped.wait(HEALTH_INTERVAL):
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process is None:
+                    if now >= worker.restart_at:
+                        self._spawn(worker)
+                    continue
+                if not worker.process.is_alive():
+                    self._stop_worker(worker, f"exited with code {worker.process.exitcode}")
+                    continue
+                with self.lock:
+                    oldest = min((self.jobs[job_id].submitted for job_id in worker.jobs), default=None)
+                if worker.ready and oldest is not None and now - max(oldest, worker.started) > self.timeout:
+                    self._stop_worker(worker, f"did not answer within {self.timeout:.0f}s")
+
+    def _read_results(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                channels = list(self.channels)
+            if not channels:
+                self.stopped.wait(0.5)
+                continue
+            for channel in connection.wait(channels, timeout=0.5):
+                self._read_result(channel)
+
+    def _read_result(self, channel):
+        try:
+            kind, key, payload = channel.recv()
+        except Exception:
+            # EOF (or a message cut short) from a worker that has exited; the monitor restarts it.
+            with self.lock:
+                self.channels.pop(channel, None)
+            channel.close()
+            return
+        if kind == 'ready':
+            worker, process = self.channels[channel]
+            # A restarted worker's old pipe may still hold its predecessor's message.
+            if worker.process is process:
+                worker.ready = True
+                worker.started = time.monotonic()
+            return
+        self._finish(key, payload)
+
+    def _finish(self, key, payload):
+        with self.lock:
+            job = self.jobs.pop(key, None)
+            if job is not None:
+                job.worker.jobs.discard(key)
+                job.worker.completed += 1
+        if job is None:
+            return  # already failed by a restart
+        if isinstance(payload, Exception):
+            self._release(job.slots)
+            job.future.set_exception(payload)
+            return
+        found = []
+        for slot, size, timings, item in zip(job.slots, job.sizes, job.timings, payload):
+            if item is None or isinstance(item, Exception):
+                found.append(item)
+                continue
+            count, results, stages = item
+            crops = np.ndarray((count,) + TEMPLATE_SHAPE, dtype=np.uint8, buffer=self.slots[slot].buf,
+                               offset=crop_offset(size))
+            found.append(([crop.copy() for crop in crops], results))
+            del crops
+            for stage_name, seconds in stages.items():
+                metrics.add_time(timings, stage_name, seconds)
+        self._release(job.slots)
+        job.future.set_result(found)
+
+    def _acquire(self, count):
+        with self.slots_cond:
+            self.slots_cond.wait_for(lambda: len(self.free) >= count)
+            taken, self.free = self.free[:count], self.free[count:]
+            return taken
+
+    def _release(self, slots):
+        with self.slots_cond:
+            self.free.extend(slots)
+            self.slots_cond.notify_all()
+
+    def fits(self, image_bytes):
+        # Whether an encoded image leaves room for MIN_CROPS crops in a slot.
+        return crop_offset(len(image_bytes)) + MIN_CROPS * TEMPLATE_BYTES <= self.slot_bytes
+
+    def _submit(self, frames):
+        # frames are (image_bytes, department, search, timings, group); returns a Future for
+        # [(crops, results) or exception].
+        slots = self._acquire(len(frames))
+        items, sizes = [], []
+        for slot, (image_bytes, department, search, _, group) in zip(slots, frames):
+            self.slots[slot].buf[:len(image_bytes)] = image_bytes
+            items.append((slot, len(image_bytes), department, search, group))
+            sizes.append(len(image_bytes))
+
+        with self.lock:
+            alive = [worker for worker in self.workers if self._alive(worker)]
+            if not alive:
+                self._release(slots)
+                raise RuntimeError("No recognition worker is running")
+            worker = min(alive, key=lambda w: (not w.ready, len(w.jobs)))
+            job = Job(next(self.ids), worker, slots, sizes, [frame[3] for frame in frames])
+            self.jobs[job.id] = job
+            worker.jobs.add(job.id)
+        worker.tasks.put(('frames', job.id, items))
+        return job.future
+
+    def recognize(self, frames):
+        # frames are (image_bytes, department, search, timings, group). Returns (crops, results) per
+        # frame, with results None unless searched, the frame's exception, or None for an image
+        # too large for a slot or with more faces than its slot holds, which the caller must
+        # handle itself. The worker's decode, detect and predict times are added to each frame's
+        # timings.
+        output = [None] * len(frames)
+        pending = [i for i, frame in enumerate(frames) if self.fits(frame[0])]
+        # Spread the frames over the workers, at most SLOTS_PER_WORKER per job.
+        per_job = max(1, min(SLOTS_PER_WORKER, -(-len(pending) // self.size)))
+        jobs = []
+        for start in range(0, len(pending), per_job):
+            indices = pending[start:start + per_job]
+            try:
+                jobs.append((indices, self._submit([frames[i] for i in indices])))
+            except Exception as e:
+                for i in indices:
+                    output[i] = e
+        for indices, future in jobs:
+            try:
+                for i, result in zip(indices, future.result()):
+                    output[i] = result
+            except Exception as e:
+                for i in indices:
+                    output[i] = e
+        return output
+
+    def reload(self, department):
+        # Makes every worker reload a shard the parent has just retrained or updated; a worker
+        # that is restarting loads everything afresh anyway.
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.tasks.put(('reload', None, department))
+
+    def stats(self):
+        with self.lock:
+            workers = [{'pid': worker.process.pid if worker.process else None, 'alive': self._alive(worker),
+                        'ready': worker.ready, 'pending_jobs': len(worker.jobs), 'completed_jobs': worker.completed}
+                       for worker in self.workers]
+            pending = len(self.jobs)
+        with self.slots_cond:
+            free = len(self.free)
+        return {
+            'processes': self.size,
+            'alive': sum(worker['alive'] for worker in workers),
+            'ready': sum(worker['ready'] for worker in workers),
+            'restarts': self.restarts,
+            'failed_jobs': self.failed,
+            'pending_jobs': pending,
+            'free_slots': free,
+            'slots': len(self.slots),
+            'workers': workers,
+        }
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        workers = [worker for worker in self.workers if worker.process is not None]
+        for worker in workers:
+            worker.tasks.put(None)
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
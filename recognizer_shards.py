@@ -0,0 +1,289 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from config import (GALLERY_BACKEND, GALLERY_DIR, MODEL_DIR, SHARD_BY_DEPARTMENT, SHARD_SEARCH_THREADS,
+                    SNAPSHOT_CHECK_INTERVAL)
+from db import get_db_connection
+from face_template import decode_template
+from gallery_store import GalleryStore, load_gallery, sync_gallery
+from lbp_matcher import create_recognizer, predict_many
+from model_snapshot import gallery_fingerprint, load_or_train, load_snapshot, save_snapshot, snapshot_stamp
+
+# Shard key of the single model used when sharding is off; it keeps the unsharded paths.
+ALL_DEPARTMENTS = None
+
+
+def department_key(department):
+    # Students without a department share the '' shard.
+    if not SHARD_BY_DEPARTMENT:
+        return ALL_DEPARTMENTS
+    return department or ''
+
+
+def shard_dir(base_dir, department):
+    if department is ALL_DEPARTMENTS:
+        return base_dir
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', department).strip('_')[:40] or 'none'
+    digest = hashlib.sha1(department.encode()).hexdigest()[:8]
+    return os.path.join(base_dir, 'departments', f"{slug}_{digest}")
+
+
+class RecognizerShard:
+    # The recognizer for one department, with its own snapshot directory, memory-mapped
+    # gallery and lock, so shards train, load, hot-swap and search independently.
+
+    def __init__(self, department=ALL_DEPARTMENTS):
+        self.department = department
+        self.model_dir = shard_dir(MODEL_DIR, department)
+        self.gallery = GalleryStore(shard_dir(GALLERY_DIR, department))
+        self.recognizer = None
+        self.label_map = {}
+        self.fingerprint = None
+        self.stamp = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        if self.department is ALL_DEPARTMENTS:
+            return "all departments"
+        return f"department '{self.department}'"
+
+    def current_fingerprint(self):
+        conn = get_db_connection()
+        try:
+            return gallery_fingerprint(conn, self.department)
+        finally:
+            conn.close()
+
+    def load_faces(self):
+        try:
+            conn = get_db_connection()
+            if GALLERY_BACKEND == 'mmap':
+                faces, labels, label_map = load_gallery(
+                    conn, self.gallery, gallery_fingerprint(conn, self.department), self.department)
+                conn.close()
+                return faces, labels, label_map
+
+            query = ("SELECT id, name, roll_number, department, face_image FROM students "
+                     "WHERE face_image IS NOT NULL")
+            params = ()
+            if self.department is not ALL_DEPARTMENTS:
+                query += " AND COALESCE(department, '') = %s"
+                params = (self.department,)
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+
+            faces, labels, label_map = [], [], {}
+            for student_id, name, roll, dept, face_blob in rows:
+                try:
+                    face = decode_template(face_blob)
+                except ValueError as e:
+                    print(f"Skipping student {student_id}: {e}")
+                    continue
+                faces.append(face)
+                labels.append(student_id)
+                label_map[student_id] = {'name': name, 'roll': roll, 'dept': dept}
+
+            return faces, labels, label_map
+        except Exception as e:
+            print(f"Error loading faces for {self}: {e}")
+            return [], [], {}
+
+    def train_from_db(self):
+        started = time.perf_counter()
+        with metrics.stage('train'):
+            faces, labels, label_map = self.load_faces()
+            if not faces:
+                return None, {}
+            model = create_recognizer()
+            model.train(faces, np.array(labels))
+        metrics.observe('face_model_train_seconds', time.perf_counter() - started, department=self.department or '')
+        print(f"Trained {self} on {len(faces)} face(s).")
+        return model, label_map
+
+    # train, load, check_snapshot and get expect the caller to hold self.lock.
+
+    def train(self):
+        try:
+            fingerprint = self.current_fingerprint()
+            model, label_map = self.train_from_db()
+            self.recognizer, self.label_map, self.fingerprint = model, label_map, fingerprint
+            if model is not None:
+                self.stamp = save_snapshot(model, label_map, fingerprint, self.model_dir)
+            return model is not None
+        except Exception as e:
+            print(f"Recognizer error ({self}): {e}")
+            return False
+
+    def load(self):
+        try:
+            fingerprint = self.current_fingerprint()
+            self.recognizer, self.label_map = load_or_train(fingerprint, self.train_from_db, self.model_dir)
+            self.fingerprint, self.stamp = fingerprint, snapshot_stamp(self.model_dir)
+            return self.recognizer is not None
+        except Exception as e:
+            print(f"Recognizer error ({self}): {e}")
+            return False
+
+    def check_snapshot(self):
+        # Hot-swap to a snapshot written by another worker since ours was loaded.
+        now = time.monotonic()
+        if now - self.last_check < SNAPSHOT_CHECK_INTERVAL:
+            return
+        self.last_check = now
+
+        stamp = snapshot_stamp(self.model_dir)
+        if stamp is not None and stamp != self.stamp:
+            snapshot = load_snapshot(self.model_dir)
+            if snapshot is not None:
+                self.recognizer, self.label_map, self.fingerprint = snapshot
+                self.stamp = stamp
+                print(f"Switched {self} to newer model snapshot ({len(self.label_map)} students).")
+
+        # register.py, app.py and the LBPH admin paths change students without writing a snapshot.
+        try:
+            fingerprint = self.current_fingerprint()
+        except Exception as e:
+            print(f"Recognizer error ({self}): {e}")
+            return
+        if fingerprint != self.fingerprint:
+            print(f"Gallery for {self} changed since its model was built; reloading.")
+            self.load()
+
+    def get(self):
+        # Loads lazily on first use or after invalidation.
+        if self.recognizer is None:
+            self.load()
+        else:
+            self.check_snapshot()
+        return self.recognizer, self.label_map
+
+    def update(self, student_id, face, info, fingerprint_before, replaced=False):
+        # fingerprint_before is the shard's fingerprint taken just before the caller's DB write.
+        with self.lock:
+            if self.recognizer is None or self.fingerprint != fingerprint_before:
+                # Our model is missing or already behind the gallery (another worker's change):
+                # adding only this student would stamp a model that lacks theirs.
+                self.load()
+                return
+            if replaced and not hasattr(self.recognizer, 'remove'):
+                # LBPH cannot forget a sample, so a replaced face needs a full retrain.
+                self.train()
+                return
+            if replaced:
+                self.recognizer.remove(student_id)
+            self.recognizer.update([face], np.array([student_id]))
+            if getattr(self.recognizer, 'needs_refit', lambda: False)():
+                # The ANN partitions were fitted on a much smaller or different gallery.
+                self.train()
+                return
+            self.label_map[student_id] = info
+            print(f"Recognizer for {self} updated with student {student_id}.")
+            try:
+                self.fingerprint = self.current_fingerprint()
+                self.stamp = save_snapshot(self.recognizer, self.label_map, self.fingerprint, self.model_dir)
+            except Exception as e:
+                print(f"Snapshot error: {e}")
+
+    def sync_gallery(self, student_id, face=None, deleted=False):
+        # Keeps this shard's memory-mapped gallery in step with changes made through this process.
+        if GALLERY_BACKEND != 'mmap':
+            return
+        try:
+            fingerprint = self.current_fingerprint()
+            with self.lock:
+                sync_gallery(self.gallery, student_id, fingerprint, face=face, deleted=deleted)
+        except Exception as e:
+            print(f"Gallery error: {e}")
+
+    def recognize(self, crops):
+        # [(student_id, confidence, info)] per crop, or None if nobody in this shard is enrolled.
+        with self.lock:
+            model, labels = self.get()
+            if model is None:
+                return None
+            return [(predicted_id, float(confidence), labels.get(predicted_id))
+                    for predicted_id, confidence in predict_many(model, crops)]
+
+
+class ShardedRecognizer:
+    # Creates department shards on first use. A search names one department, or fans out to
+    # every department with enrolled faces in parallel and keeps the closest match per crop.
+
+    def __init__(self):
+        self.shards = {}
+        self.lock = threading.Lock()
+        self.departments = None
+        self.departments_checked = 0.0
+        self.executor = None
+
+    def shard(self, department):
+        key = department_key(department)
+        with self.lock:
+            shard = self.shards.get(key)
+            if shard is None:
+                shard = self.shards[key] = RecognizerShard(key)
+            return shard
+
+    def known_departments(self):
+        # Departments with enrolled faces, re-read from the database every SNAPSHOT_CHECK_INTERVAL.
+        now = time.monotonic()
+        if self.departments is None or now - self.departments_checked >= SNAPSHOT_CHECK_INTERVAL:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT DISTINCT COALESCE(department, '') FROM students WHERE face_image IS NOT NULL")
+            self.departments = sorted(row[0] for row in cursor.fetchall())
+            cursor.close()
+            conn.close()
+            self.departments_checked = now
+        return self.departments
+
+    def all_shards(self):
+        if not SHARD_BY_DEPARTMENT:
+            return [self.shard(ALL_DEPARTMENTS)]
+        return [self.shard(department) for department in self.known_departments()]
+
+    def map(self, function, shards):
+        if len(shards) < 2:
+            return [function(shard) for shard in shards]
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS,
+                                                   thread_name_prefix='shard-search')
+        return list(self.executor.map(function, shards))
+
+    def load_all(self):
+        def load(shard):
+            with shard.lock:
+                return shard.load()
+        return sum(self.map(load, self.all_shards()))
+
+    def recognize(self, crops, department=None):
+        # None if no searched shard has enrolled faces.
+        if department is not None:
+            key = department_key(department)
+            if SHARD_BY_DEPARTMENT and key not in self.shards and key not in self.known_departments():
+                # Nobody is enrolled there; a client-supplied name must not create a shard.
+                return None
+            return self.shard(department).recognize(crops)
+
+        best = None
+        for results in self.map(lambda shard: shard.recognize(crops), self.all_shards()):
+            if results is None:
+                continue
+            if best is None:
+                best = results
+            else:
+                best = [min(a, b, key=lambda r: r[1]) for a, b in zip(best, results)]
+        return best
@@ -1,24 +1,21 @@
 import cv2
-import pickle
 import mysql.connector
 import sys
 import os
 
+from config import DB_CONFIG
+from db import connect_server, get_db_connection
+from face_detect import local_detector
+from frame_gate import MotionGate, QualityGate
+from face_template import encode_template
+from face_tracker import FaceTracker
+from video_pipeline import VideoPipeline
+
 if sys.platform.startswith('win'):
     import codecs
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
 
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'root',
-    'password': '',
-    'database': 'face_attendance',
-    'charset': 'utf8mb4',
-    'collation': 'utf8mb4_unicode_ci'
-}
-
-
 def get_cascade_path():
     possible_paths = [
         'haarcascade_frontalface_default.xml',
@@ -36,23 +33,22 @@ def get_cascade_path():
 
 def init_database():
     try:
-        config = DB_CONFIG.copy()
-        config.pop('database', None)
-
-        conn = mysql.connector.connect(**config)
+        database = DB_CONFIG['database']
+        conn = connect_server()
         cursor = conn.cursor()
 
-        cursor.execute("CREATE DATABASE IF NOT EXISTS face_attendance CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
         print(" Database created or verified")
 
-        cursor.execute("USE face_attendance")
+        cursor.execute(f"USE `{database}`")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS students (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 name VARCHAR(255) NOT NULL,
                 roll_number VARCHAR(50) NOT NULL UNIQUE,
                 face_image LONGBLOB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """)
         conn.commit()
@@ -69,7 +65,7 @@ def init_database():
 
 def test_database_connection():
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db_connection()
         conn.close()
         print(" Database connection successful")
         return True
@@ -81,9 +77,15 @@ def test_database_connection():
         return False
 
 
-def register_student(name, roll_number, face_cascade):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+def detect_faces(gray, cascade_path):
+    return local_detector(cascade_path, min_size=100).detect(gray)
+
+
+def register_student(name, roll_number, cascade_path):
+    motion, quality = MotionGate(), QualityGate()
+    tracker = FaceTracker(lambda gray: detect_faces(gray, cascade_path), motion=motion)
+    pipeline = VideoPipeline(lambda frame: [box for _, box, _ in tracker.update(frame.gray, frame.index)])
+    if not pipeline.start():
         print(" Could not open webcam")
         return False
 
@@ -93,14 +95,9 @@ def register_student(name, roll_number, face_cascade):
 
     face_captured = False
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print(" Failed to read frame")
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(100, 100))
+    for captured in pipeline.frames():
+        frame, gray = captured.image, captured.gray
+        faces = captured.result if captured.result is not None else ()
 
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
@@ -114,6 +111,7 @@ def register_student(name, roll_number, face_cascade):
             cv2.putText(frame, 'Multiple faces - Show only one', (20, 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
 
+        pipeline.draw_stats(frame)
         cv2.imshow('Register Face - SPACE to capture, Q to quit', frame)
 
         key = cv2.waitKey(1) & 0xFF
@@ -121,12 +119,16 @@ def register_student(name, roll_number, face_cascade):
             print(" Registration cancelled")
             break
         elif key == ord(' ') and len(faces) == 1:
+            x, y, w, h = faces[0]
+            face_crop = gray[y:y+h, x:x+w]
+            problem = quality.problem(face_crop)
+            if problem:
+                print(f" Face image is {problem}, please try again")
+                continue
             try:
-                x, y, w, h = faces[0]
-                face_crop = gray[y:y+h, x:x+w]
-                face_blob = pickle.dumps(face_crop)
+                face_blob = encode_template(face_crop)
 
-                conn = mysql.connector.connect(**DB_CONFIG)
+                conn = get_db_connection()
                 cursor = conn.cursor()
 
                 cursor.execute("SELECT id FROM students WHERE roll_number = %s", (roll_number,))
@@ -149,7 +151,10 @@ def register_student(name, roll_number, face_cascade):
                 print(f" Error during registration: {e}")
                 break
 
-    cap.release()
+    if pipeline.read_failed:
+        print(" Failed to read frame")
+    pipeline.stop()
+    print(f" Gating: {motion.stats_text()}, {quality.stats_text()}")
     cv2.destroyAllWindows()
     return face_captured
 
@@ -186,7 +191,7 @@ def start_registration():
             print(" Invalid roll number")
             continue
 
-        success = register_student(name, roll_number, face_cascade)
+        success = register_student(name, roll_number, cascade_path)
 
         if success:
             print(" Registration completed")
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class RequestBatcher:
+    # Coalesces submit() calls from concurrent request threads into batches for process(items),
+    # which runs on one dispatcher thread and returns one result per item; a result that is an
+    # exception is raised in that item's caller only. A batch closes when it holds max_size items
+    # or when its first item has waited max_wait seconds, so batching adds at most max_wait to a
+    # request's latency. Requests that arrive while a batch is being processed form the next one.
+
+    def __init__(self, process, max_size, max_wait):
+        self.process = process
+        self.max_size = max(1, max_size)
+        self.max_wait = max(0.0, max_wait)
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_size > 1 and self.max_wait > 0
+
+    def submit(self, item):
+        if not self.enabled:
+            return self._unwrap(self.process([item])[0])
+        future = Future()
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='request-batcher', daemon=True)
+                self.thread.start()
+            self.pending.append((item, future, time.monotonic()))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_size:
+                self.cond.notify()
+        return self._unwrap(future.result())
+
+    @staticmethod
+    def _unwrap(result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _take(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.pending)
+            deadline = self.pending[0][2] + self.max_wait
+            while len(self.pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = [self.pending.popleft() for _ in range(min(len(self.pending), self.max_size))]
+
+            now = time.monotonic()
+            waited = [now - queued_at for _, _, queued_at in batch]
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+            self.wait_total += sum(waited)
+            self.wait_max = max(self.wait_max, max(waited))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            try:
+                results = self.process([item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'enabled': self.enabled,
+                'max_size': self.max_size,
+                'max_wait_ms': 1000 * self.max_wait,
+                'pending': len(self.pending),
+                'batches': self.batches,
+                'requests': self.items,
+                'avg_batch': self.items / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest,
+                'wait_avg_ms': 1000 * self.wait_total / self.items if self.items else 0.0,
+                'wait_max_ms': 1000 * self.wait_max,
+            }
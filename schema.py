@@ -0,0 +1,63 @@
+def column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def migrate(conn):
+    cursor = conn.cursor()
+    try:
+        if not column_exists(cursor, 'students', 'updated_at'):
+            # Lets the gallery fingerprint notice edits without reading face blobs.
+            cursor.execute(
+                "ALTER TABLE students ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)"
+            )
+            print(" Added students.updated_at")
+        if not column_exists(cursor, 'attendance_log', 'spool_ref'):
+            # Identifies rows written from the local attendance spool so a replayed batch is ignored.
+            cursor.execute("ALTER TABLE attendance_log ADD COLUMN spool_ref CHAR(32) NULL")
+            print(" Added attendance_log.spool_ref")
+        if not index_exists(cursor, 'attendance_log', 'uq_attendance_spool_ref'):
+            cursor.execute("ALTER TABLE attendance_log ADD UNIQUE KEY uq_attendance_spool_ref (spool_ref)")
+        if not column_exists(cursor, 'attendance_log', 'attend_date'):
+            # Stored date so same-day lookups can use an index instead of scanning DATE(timestamp).
+            cursor.execute("ALTER TABLE attendance_log ADD COLUMN attend_date DATE AS (DATE(timestamp)) STORED")
+            print(" Added attendance_log.attend_date")
+        if not index_exists(cursor, 'attendance_log', 'uq_attendance_roll_date'):
+            # Keep the first mark of each student per day so the unique key can be built.
+            cursor.execute(
+                "DELETE dup FROM attendance_log dup JOIN attendance_log kept "
+                "ON dup.roll_number = kept.roll_number AND dup.attend_date = kept.attend_date "
+                "AND dup.id > kept.id"
+            )
+            if cursor.rowcount:
+                print(f" Removed {cursor.rowcount} duplicate attendance row(s)")
+            cursor.execute("ALTER TABLE attendance_log ADD UNIQUE KEY uq_attendance_roll_date (roll_number, attend_date)")
+            print(" Added unique (roll_number, attend_date) key")
+        if not index_exists(cursor, 'attendance_log', 'idx_attendance_date'):
+            cursor.execute("ALTER TABLE attendance_log ADD KEY idx_attendance_date (attend_date, timestamp)")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    migrate(conn)
+    conn.close()
+    print(" Schema is up to date.")
@@ -0,0 +1,92 @@
+import argparse
+import itertools
+import time
+
+import cv2
+
+from config import DETECTION_PROFILES_PATH
+from face_detect import FaceDetector, count_hits, load_samples, save_profile
+
+def evaluate(detector, images, labels, repeat, min_iou):
+    elapsed = 0.0
+    expected = hits = found = 0
+    for name, gray in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            boxes = detector.detect(gray)
+            elapsed += time.perf_counter() - start
+        truth = labels.get(name, [])
+        expected += len(truth)
+        hits += count_hits(boxes, truth, min_iou)
+        found += len(boxes)
+    return {
+        'ms': 1000 * elapsed / (len(images) * repeat),
+        'recall': hits / expected if expected else 1.0,
+        'precision': hits / found if found else 1.0,
+    }
+
+def run(args):
+    images, labels = load_samples(args.samples)
+    if not images:
+        print(f" No images found in {args.samples}")
+        return
+    if labels is None:
+        print(f" {args.samples} has no labels.csv (file,x,y,w,h per face); cannot measure hit rate.")
+        return
+    print(f" Tuning on {len(images)} frame(s) with {sum(map(len, labels.values()))} labelled face(s)")
+
+    cascade = cv2.CascadeClassifier(args.cascade)
+    fixed = {'roi': args.roi, 'distance_min': args.distance_min, 'distance_max': args.distance_max,
+             'hfov': args.hfov}
+    results = []
+    for scale_factor, min_neighbors, min_size, max_side in itertools.product(
+            args.scale_factor, args.min_neighbors, args.min_size, args.max_side):
+        settings = dict(fixed, scale_factor=scale_factor, min_neighbors=min_neighbors, min_size=min_size,
+                        max_side=max_side)
+        score = evaluate(FaceDetector(cascade, **settings), images, labels, args.repeat, args.iou)
+        results.append((settings, score))
+
+    results.sort(key=lambda r: r[1]['ms'])
+    print(f"\n {'scale':>6} {'neigh':>6} {'minsz':>6} {'side':>6} {'ms':>8} {'recall':>7} {'prec':>6}")
+    for settings, score in results:
+        print(f" {settings['scale_factor']:>6} {settings['min_neighbors']:>6} {settings['min_size']:>6} "
+              f"{settings['max_side']:>6} {score['ms']:>8.1f} {score['recall']:>7.3f} {score['precision']:>6.3f}")
+
+    # Fastest setting that reaches the target; ties in speed go to the more precise one.
+    passing = [r for r in results if r[1]['recall'] >= args.target_recall]
+    if passing:
+        settings, score = min(passing, key=lambda r: (round(r[1]['ms'], 1), -r[1]['precision']))
+    else:
+        settings, score = max(results, key=lambda r: (r[1]['recall'], -r[1]['ms']))
+        print(f"\n No setting reached recall {args.target_recall}; keeping the best recall instead.")
+
+    print(f"\n Profile '{args.name}': scaleFactor {settings['scale_factor']}, minNeighbors {settings['min_neighbors']}, "
+          f"minSize {settings['min_size']}, max side {settings['max_side']} -> {score['ms']:.1f} ms, "
+          f"recall {score['recall']:.3f}, precision {score['precision']:.3f}")
+    if args.dry_run:
+        return
+    save_profile(args.name, settings, dict(score, samples=len(images), target_recall=args.target_recall),
+                 args.profiles)
+    print(f" Saved to {args.profiles}. Use it with FACE_DETECTION_PROFILE={args.name}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep face detection parameters on labelled frames from one camera")
+    parser.add_argument('samples', help="folder of frames with labels.csv (file,x,y,w,h per face)")
+    parser.add_argument('--name', required=True, help="profile name, e.g. the camera or kiosk id")
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--scale-factor', type=float, nargs='+', default=[1.05, 1.1, 1.15, 1.2, 1.3])
+    parser.add_argument('--min-neighbors', type=int, nargs='+', default=[3, 4, 5, 6, 8])
+    parser.add_argument('--min-size', type=int, nargs='+', default=[0, 40, 60, 80, 100],
+                        help="smallest face in full-frame pixels (0 = from --distance-max only)")
+    parser.add_argument('--max-side', type=int, nargs='+', default=[320, 480, 640, 0],
+                        help="longest side detection runs at (0 = full size)")
+    parser.add_argument('--roi', default='', help="x,y,w,h as fractions of the frame")
+    parser.add_argument('--distance-min', type=float, default=0.0, help="0 = no largest face")
+    parser.add_argument('--distance-max', type=float, default=3.0)
+    parser.add_argument('--hfov', type=float, default=65)
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--cascade', default='haarcascade_frontalface_default.xml')
+    parser.add_argument('--profiles', default=DETECTION_PROFILES_PATH)
+    parser.add_argument('--dry-run', action='store_true', help="print the sweep without saving a profile")
+    run(parser.parse_args())
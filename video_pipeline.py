@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from config import PIPELINE_QUEUE_SIZE, PIPELINE_WORKERS
+
+METER_WINDOW = 2.0
+
+
+class DropOldestQueue:
+    # Bounded queue whose put never blocks: when full, the oldest item is discarded so
+    # consumers always see the freshest frames.
+
+    def __init__(self, maxsize):
+        self.items = deque()
+        self.maxsize = max(1, maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        # None once the queue is closed and drained, or on timeout.
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class RateMeter:
+    # Events per second over the last couple of seconds.
+
+    def __init__(self, window=METER_WINDOW):
+        self.window = window
+        self.times = deque()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.times.append(now)
+            self.total += 1
+            while self.times and now - self.times[0] > self.window:
+                self.times.popleft()
+
+    def rate(self):
+        with self.lock:
+            if len(self.times) < 2:
+                return 0.0
+            span = self.times[-1] - self.times[0]
+            return (len(self.times) - 1) / span if span > 0 else 0.0
+
+
+class Frame:
+    def __init__(self, index, image):
+        self.index = index
+        self.image = image
+        self.captured_at = time.monotonic()
+        self.gray = None
+        self.result = None
+        self.error = None
+
+
+class VideoPipeline:
+    # Capture thread -> worker pool -> display (the caller's thread), joined by drop-oldest
+    # queues. Capture keeps reading so the camera buffer never holds stale frames, workers run
+    # process(frame) (OpenCV releases the GIL), and frames() yields results in capture order,
+    # skipping any that a faster worker has already overtaken.
+
+    def __init__(self, process, source=0, workers=PIPELINE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+        self.process = process
+        self.source = source
+        self.workers = max(1, workers)
+        self.frames_in = DropOldestQueue(queue_size)
+        self.frames_out = DropOldestQueue(queue_size)
+        self.capture_rate = RateMeter()
+        self.process_rate = RateMeter()
+        self.display_rate = RateMeter()
+        self.latencies = deque(maxlen=120)
+        self.stopped = threading.Event()
+        self.read_failed = False
+        self.threads = []
+        self.active_workers = 0
+        self.workers_lock = threading.Lock()
+        self.started_at = None
+        self.cap = None
+
+    def start(self):
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            return False
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.started_at = time.monotonic()
+        self.active_workers = self.workers
+        self.threads = [threading.Thread(target=self._capture, name='capture', daemon=True)]
+        self.threads += [threading.Thread(target=self._work, name=f'detect-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return True
+
+    def _capture(self):
+        index = 0
+        while not self.stopped.is_set():
+            ret, image = self.cap.read()
+            if not ret:
+                self.read_failed = True
+                break
+            self.frames_in.put(Frame(index, image))
+            self.capture_rate.tick()
+            index += 1
+        self.frames_in.close()
+
+    def _work(self):
+        while not self.stopped.is_set():
+            frame = self.frames_in.get(timeout=0.5)
+            if frame is None:
+                if self.frames_in.closed:
+                    break
+                continue
+            try:
+                frame.gray = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
+                frame.result = self.process(frame)
+            except Exception as e:
+                frame.error = e
+            self.frames_out.put(frame)
+            self.process_rate.tick()
+        with self.workers_lock:
+            self.active_workers -= 1
+            if not self.active_workers:
+                self.frames_out.close()
+
+    def frames(self):
+        last_index = -1
+        while not self.stopped.is_set():
+            frame = self.frames_out.get(timeout=0.5)
+            if frame is None:
+                if self.frames_out.closed:
+                    break
+                continue
+            if frame.index <= last_index:
+                continue
+            last_index = frame.index
+            now = time.monotonic()
+            self.display_rate.tick(now)
+            self.latencies.append(now - frame.captured_at)
+            yield frame
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'capture_fps': self.capture_rate.rate(),
+            'process_fps': self.process_rate.rate(),
+            'display_fps': self.display_rate.rate(),
+            'latency_ms': 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            'latency_p95_ms': 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+            'dropped': self.frames_in.dropped + self.frames_out.dropped,
+        }
+
+    def stats_text(self):
+        s = self.stats()
+        return (f"cap {s['capture_fps']:.0f} fps | det {s['process_fps']:.0f} fps | "
+                f"disp {s['display_fps']:.0f} fps | {s['latency_ms']:.0f} ms")
+
+    def draw_stats(self, image):
+        cv2.putText(image, self.stats_text(), (10, image.shape[0] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+
+    def stop(self):
+        self.stopped.set()
+        self.frames_in.close()
+        self.frames_out.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        if self.cap is not None:
+            self.cap.release()
+        if self.started_at is None:
+            return
+        # Whole-session averages rather than the rolling rates shown on screen.
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        s = self.stats()
+        print(f" Pipeline: capture {self.capture_rate.total / elapsed:.1f} fps, "
+              f"detect {self.process_rate.total / elapsed:.1f} fps, "
+              f"display {self.display_rate.total / elapsed:.1f} fps, latency {s['latency_ms']:.0f} ms "
+              f"(p95 {s['latency_p95_ms']:.0f} ms), {s['dropped']} stale frame(s) dropped")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()